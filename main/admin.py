@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notify, User, Food, Review, Image, Coupon, Status, Bill, Item, Reply
+from .models import Notify, User, Food, Review, Image, Coupon, Status, Bill, Item, Reply, CaptureJob
 
 @admin.register(Notify)
 class Notify(admin.ModelAdmin):
@@ -14,7 +14,9 @@ class ImageInline(admin.TabularInline):
 
 @admin.register(Food)
 class Food(admin.ModelAdmin):
-    list_display = ('name', 'price', 'description', 'discount', 'order_count')
+    list_display = ('name', 'price', 'description', 'discount', 'order_count', 'avg_rating', 'rating_count')
+    # Counters maintained by the application, rebuilt with `rebuild_ratings` and `reconcile_order_counts`
+    readonly_fields = ('order_count', 'rating_count', 'rating_sum', 'avg_rating', 'star1_count', 'star2_count', 'star3_count', 'star4_count', 'star5_count')
     inlines = [ImageInline]
 
 class ReplyInline(admin.TabularInline):
@@ -27,7 +29,7 @@ class Review(admin.ModelAdmin):
 
 @admin.register(Coupon)
 class Coupon(admin.ModelAdmin):
-    list_display = ('code', 'value', 'is_active', 'start', 'end')
+    list_display = ('code', 'value', 'is_active', 'start', 'end', 'use_count', 'max_uses')
 
 class ItemInline(admin.TabularInline):
     model = Item
@@ -40,3 +42,8 @@ class Bill(admin.ModelAdmin):
 @admin.register(Status)
 class Status(admin.ModelAdmin):
     list_display = ('name', 'description')
+
+@admin.register(CaptureJob)
+class CaptureJob(admin.ModelAdmin):
+    list_display = ('payment_id', 'bill', 'amount', 'state', 'attempts', 'run_after')
+    list_filter = ('state',)
@@ -0,0 +1,4 @@
+'''
+Load test of the storefront: `data` seeds a synthetic dataset, `journey` scripts what a customer does,
+`report` turns the timings into per-route percentiles. Run with `manage.py loadtest`.
+'''
@@ -0,0 +1,77 @@
+'''
+Synthetic dataset for the load test, inserted in bulk and removed afterwards.
+The generated rows are recognized by MARKER (descriptions, comments) and EMAIL_DOMAIN.
+'''
+from django.db import transaction
+from main.models import User, Food, Review, Reply, Image, Bill, Item
+from main.utils import search
+from main.utils.constant import StatusName
+from main.utils.statuses import get_status
+import collections
+
+MARKER = '[loadtest]'
+EMAIL_DOMAIN = 'loadtest.local'
+PASSWORD = 'loadtest-password'
+WORDS = [
+    'phở', 'bún', 'chả', 'bánh', 'mì', 'cơm', 'tấm', 'gà', 'bò', 'heo', 'nem', 'cuốn', 'canh', 'chua',
+    'sushi', 'pizza', 'taco', 'burger', 'salad', 'noodle', 'soup', 'grilled', 'fried', 'spicy', 'rice',
+]
+
+Scale = collections.namedtuple('Scale', 'foods users reviews replies orders items_per_order')
+Scale.__new__.__defaults__ = (1000, 50, 3000, 1000, 300, 3)
+
+def generate(scale, rng, batch_size=1000):
+    '''Inserts the dataset and rebuilds what the signals would have maintained. Returns the users.'''
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(username=f'loadtest{i}', email=f'loadtest{i}@{EMAIL_DOMAIN}') for i in range(scale.users)
+        ], batch_size=batch_size)
+        users = list(User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').order_by('id'))
+
+        Food.objects.bulk_create([
+            Food(
+                name=' '.join(rng.sample(WORDS, rng.choice((2, 3)))),
+                description=' '.join(rng.choice(WORDS) for _ in range(10)) + f' {MARKER}',
+                price=rng.randint(2, 40),
+            )
+            for _ in range(scale.foods)
+        ], batch_size=batch_size)
+        foods = list(Food.objects.filter(description__endswith=MARKER).only('id', 'price'))
+        Image.objects.bulk_create([Image(food=food, url='/static/img/default.jpeg') for food in foods], batch_size=batch_size)
+
+        Review.objects.bulk_create([
+            Review(comment=MARKER, rating=rng.randint(1, 5), user=rng.choice(users), food=rng.choice(foods))
+            for _ in range(scale.reviews)
+        ], batch_size=batch_size)
+        reviews = list(Review.objects.filter(comment=MARKER).only('id'))
+        if reviews:
+            Reply.objects.bulk_create([
+                Reply(content=MARKER, parent=rng.choice(reviews), user=rng.choice(users)) for _ in range(scale.replies)
+            ], batch_size=batch_size)
+
+        purchased = get_status(StatusName.PURCHASED)
+        orders = [
+            Bill(user=rng.choice(users), recipient=MARKER, phone_number='123456789', address='1 Main Street', status=purchased)
+            for _ in range(scale.orders)
+        ]
+        Bill.objects.bulk_create(orders, batch_size=batch_size)
+        Item.objects.bulk_create([
+            Item(bill=order, food=food, quantity=rng.randint(1, 3), unit_price=food.price)
+            for order in orders for food in rng.sample(foods, min(scale.items_per_order, len(foods)))
+        ], batch_size=batch_size)
+
+    Food.objects.rebuild_rating_aggregates(food_ids=[food.id for food in foods])
+    # The best sellers follow the purchased bills
+    Food.objects.rebuild_order_counts()
+    search.get_backend().rebuild()
+    return users
+
+def cleanup():
+    '''Removes the generated rows, and the orders placed by the generated users.'''
+    with transaction.atomic():
+        Item.objects.filter(bill__user__email__endswith=f'@{EMAIL_DOMAIN}').delete()
+        Bill.objects.filter(user__email__endswith=f'@{EMAIL_DOMAIN}').delete()
+        Food.objects.filter(description__endswith=MARKER).delete()
+        User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+    Food.objects.rebuild_order_counts()
+    search.get_backend().rebuild()
@@ -0,0 +1,152 @@
+'''
+The scripted customer journey and the two ways of driving it:
+Django's test client through the WSGI handler, or the async test client through the ASGI handler.
+'''
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from django.utils.http import urlencode
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import collections
+import json
+import re
+import time
+import uuid
+from main.utils import payments
+
+Step = collections.namedtuple('Step', 'route method url data')
+
+FOOD_LINK = re.compile(r'/food/(\d+)/details/')
+ORDER_TOKEN = re.compile(r'name="orderToken" value="([0-9a-f-]+)"')
+ORDER_ID = re.compile(r'data-order="([0-9a-f-]+)"')
+
+class JourneyAborted(Exception):
+    pass
+
+def _match(pattern, response):
+    match = pattern.search(response.content.decode())
+    if match is None:
+        raise JourneyAborted(f'{pattern.pattern} not found')
+    return match.group(1)
+
+def customer_journey(rng, words, cart_size=3):
+    '''
+    Browse the menu, search, open a food, fill the cart, check out and pay with the fake gateway.
+    A generator of Steps: the driver sends back the response of each step.
+    '''
+    yield Step('index', 'get', reverse('index'), None)
+    response = yield Step('menu-page', 'get', reverse('menu-page'), None)
+    page = json.loads(response.content)
+    food_ids = FOOD_LINK.findall(page['html'])
+    if page['next_url']:
+        response = yield Step('menu-page', 'get', page['next_url'], None)
+        food_ids += FOOD_LINK.findall(json.loads(response.content)['html'])
+
+    response = yield Step('search', 'get', reverse('search'), {'query': ' '.join(rng.sample(words, 2))})
+    food_ids += FOOD_LINK.findall(response.content.decode())
+    food_ids = sorted(set(food_ids))
+    if not food_ids:
+        raise JourneyAborted('Empty menu')
+    chosen = rng.sample(food_ids, min(cart_size, len(food_ids)))
+
+    yield Step('food-details', 'get', reverse('food-details', args=[chosen[0]]), None)
+    for food_id in chosen:
+        response = yield Step('add-to-cart', 'post', reverse('add-to-cart'), {'id': food_id})
+        if json.loads(response.content)['action'] == 'remove':
+            # Left in the cart by an interrupted journey of the same user
+            yield Step('add-to-cart', 'post', reverse('add-to-cart'), {'id': food_id})
+    yield Step('cart', 'get', reverse('cart'), None)
+
+    quantities = {food_id: rng.randint(1, 3) for food_id in chosen}
+    response = yield Step('checkout', 'post', reverse('checkout'), {'checkoutip': json.dumps(quantities)})
+    order_token = _match(ORDER_TOKEN, response)
+    response = yield Step('handle-checkout', 'post', reverse('handle-checkout'), {
+        'inputName': 'Load Test', 'inputPhoneNo': '123456789', 'inputAddress': '1 Main Street',
+        'inputCity': 'Hanoi', 'inputCountry': 'Vietnam', 'inputZip': '10000', 'inputShipNote': '-',
+        'orderToken': order_token,
+    })
+    order_id = _match(ORDER_ID, response)
+
+    response = yield Step('open-payment', 'post', reverse('open-payment'), {'lang': '/en-us/', 'order_id': order_id})
+    rzp_order_id = json.loads(response.content)['rp_order_id']
+    payment_id = f'pay_{uuid.uuid4().hex[:14]}'
+    yield Step('handle-payment', 'post', reverse('handle-payment'), {
+        'razorpay_order_id': rzp_order_id,
+        'razorpay_payment_id': payment_id,
+        'razorpay_signature': payments.sign(rzp_order_id, payment_id, settings.RAZORPAY_KEY_SECRET),
+    })
+
+def _request(client, step):
+    if step.method == 'post':
+        # Form encoded, as sent by the pages (the 3.1 async client cannot read multipart bodies)
+        return client.post(step.url, data=urlencode(step.data), content_type='application/x-www-form-urlencoded')
+    return getattr(client, step.method)(step.url, data=step.data)
+
+def _run_sync(client, journey, recorder):
+    try:
+        step = next(journey)
+        while True:
+            start = time.perf_counter()
+            response = _request(client, step)
+            recorder.add(step.route, time.perf_counter() - start, response.status_code)
+            if response.status_code >= 400:
+                return
+            step = journey.send(response)
+    except StopIteration:
+        pass
+    except (JourneyAborted, ValueError, KeyError) as error:
+        recorder.abort(str(error))
+
+def run_wsgi(users, journeys, recorder, concurrency=1):
+    '''Runs the journeys in `concurrency` threads, each request through the WSGI handler.'''
+    def run(i, journey):
+        client = Client()
+        client.force_login(users[i % len(users)])
+        _run_sync(client, journey, recorder)
+
+    def worker(i, journey):
+        try:
+            run(i, journey)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+    if concurrency == 1:
+        for i, journey in enumerate(journeys):
+            run(i, journey)
+        return
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(len(journeys)), journeys))
+
+async def _run_async(client, journey, recorder):
+    try:
+        step = next(journey)
+        while True:
+            start = time.perf_counter()
+            response = await _request(client, step)
+            recorder.add(step.route, time.perf_counter() - start, response.status_code)
+            if response.status_code >= 400:
+                return
+            step = journey.send(response)
+    except StopIteration:
+        pass
+    except (JourneyAborted, ValueError, KeyError) as error:
+        recorder.abort(str(error))
+
+def run_asgi(users, journeys, recorder, concurrency=1):
+    '''Runs the journeys as `concurrency` concurrent tasks, each request through the ASGI handler.'''
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i, journey):
+            async with semaphore:
+                client = AsyncClient()
+                await sync_to_async(client.force_login)(users[i % len(users)])
+                await _run_async(client, journey, recorder)
+
+        await asyncio.gather(*(one(i, journey) for i, journey in enumerate(journeys)))
+
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+'''
+Per-route latency percentiles and throughput of a load test run, saved as JSON to compare commits.
+'''
+from django.conf import settings
+from django.utils import timezone
+import collections
+import json
+import math
+import statistics
+import subprocess
+import threading
+
+PERCENTILES = (50, 95, 99)
+
+def percentile(sorted_values, p):
+    '''Nearest-rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Recorder:
+    '''Collects the latency of every request, from any thread.'''
+    def __init__(self):
+        self.timings = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.aborted = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, status_code):
+        with self._lock:
+            self.timings[route].append(seconds)
+            if status_code >= 400:
+                self.errors[route] += 1
+
+    def abort(self, reason):
+        with self._lock:
+            self.aborted[reason] += 1
+
+    def summary(self, elapsed, **info):
+        routes = {}
+        for route, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            routes[route] = {
+                'count': len(timings),
+                'errors': self.errors[route],
+                'rps': round(len(timings) / elapsed, 2) if elapsed else 0,
+                'mean_ms': round(statistics.mean(timings) * 1000, 2),
+                **{f'p{p}_ms': round(percentile(timings, p) * 1000, 2) for p in PERCENTILES},
+                'max_ms': round(timings[-1] * 1000, 2),
+            }
+        requests = sum(route['count'] for route in routes.values())
+        return {
+            'created': timezone.now().isoformat(),
+            'commit': current_commit(),
+            **info,
+            'elapsed_s': round(elapsed, 3),
+            'requests': requests,
+            'rps': round(requests / elapsed, 2) if elapsed else 0,
+            'aborted_journeys': dict(self.aborted),
+            'routes': routes,
+        }
+
+def save(summary, path):
+    with open(path, 'w') as output:
+        json.dump(summary, output, indent=2)
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
+
+def format_table(summary):
+    lines = [f'{"route":<16} {"count":>6} {"err":>4} {"rps":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}']
+    for route, stats in summary['routes'].items():
+        lines.append(
+            f'{route:<16} {stats["count"]:>6} {stats["errors"]:>4} {stats["rps"]:>8.1f} '
+            f'{stats["p50_ms"]:>9.2f} {stats["p95_ms"]:>9.2f} {stats["p99_ms"]:>9.2f}'
+        )
+    lines.append(f'{summary["requests"]} requests in {summary["elapsed_s"]} s: {summary["rps"]} requests/s')
+    return lines
+
+def format_comparison(summary, previous):
+    '''p95 of every route against a previous run, e.g. of another commit.'''
+    lines = [f'p95 against {previous.get("commit") or "previous run"} ({previous.get("created", "?")})']
+    for route, stats in summary['routes'].items():
+        before = previous.get('routes', {}).get(route)
+        if not before or not before['p95_ms']:
+            continue
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        lines.append(f'{route:<16} {before["p95_ms"]:>9.2f} -> {stats["p95_ms"]:>9.2f} ms  {change:+.1f}%')
+    if previous.get('rps'):
+        lines.append(f'throughput {previous["rps"]} -> {summary["rps"]} requests/s')
+    return lines
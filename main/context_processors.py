@@ -1,4 +1,6 @@
 from django.conf import settings
+from .utils.cart import get_cart
+from .utils.user_state import get_user_state
 
 def login_redirect(request):
     url = request.META.get('HTTP_REFERER', settings.LOGIN_REDIRECT_URL)
@@ -9,3 +11,11 @@ def login_redirect(request):
         url = settings.LOGIN_REDIRECT_URL
     
     return {'LOGIN_REDIRECT_URL': url}
+
+def user_state(request):
+    # Lazy: the cart and wishlist ids are only queried if a template uses them
+    return {'user_state': get_user_state(request)}
+
+def current_cart(request):
+    # Lazy as well: the cart is only loaded if a template uses it
+    return {'current_cart': get_cart(request)}
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from main.models import Food
+from main.utils import search
+import functools
+import random
+import statistics
+import time
+
+SYLLABLES = [
+    'phở', 'bún', 'chả', 'bánh', 'mì', 'cơm', 'tấm', 'gà', 'bò', 'heo', 'đậu', 'hũ', 'nem', 'cuốn',
+    'canh', 'chua', 'xèo', 'lụi', 'sushi', 'pizza', 'taco', 'burger', 'salad', 'noodle', 'soup',
+    'grilled', 'fried', 'spicy', 'beef', 'chicken', 'pork', 'tofu', 'rice', 'cheese', 'tomato',
+]
+SEED_MARKER = '[benchmark]'
+VOCABULARY_SIZE = 3000
+
+def q_chain_search(query):
+    # The search `index` used before the search backends
+    keywords = query.split()
+    foods = Food.objects.filter(functools.reduce(lambda x, y: x | y, [Q(name__icontains=word) for word in keywords]))
+    return list(foods.values_list('id', flat=True))
+
+class Command(BaseCommand):
+    help = 'Compare the latency of the search backends with the former icontains Q-chain.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Create this many synthetic foods first (removed afterwards).')
+        parser.add_argument('--queries', type=int, default=200, help='Number of queries per contender.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic foods.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        # Dish words made of one or two syllables: "bánh", "bánhxèo", "phởgà", ...
+        self.words = sorted({''.join(rng.sample(SYLLABLES, rng.choice((1, 2)))) for _ in range(VOCABULARY_SIZE)})
+        if options['seed']:
+            self.seed(options['seed'], rng)
+        else:
+            # Only the configured backend follows the changes of the foods
+            search.TokenIndexBackend().rebuild()
+            search.DatabaseSearchBackend().rebuild()
+
+        try:
+            queries = self.make_queries(options['queries'], rng)
+            contenders = {
+                'Q-chain (icontains)': q_chain_search,
+                'TokenIndexBackend': search.TokenIndexBackend().search,
+                'DatabaseSearchBackend': search.DatabaseSearchBackend().search,
+                'InvertedIndexBackend': search.InvertedIndexBackend().search,
+            }
+            self.stdout.write(f'{Food.objects.count()} foods, {len(queries)} queries')
+            for name, func in contenders.items():
+                func(queries[0])  # warm up
+                timings, hits = [], 0
+                for query in queries:
+                    start = time.perf_counter()
+                    hits += len(func(query))
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{name:<24} mean {statistics.mean(timings):8.2f} ms  '
+                    f'p95 {timings[int(len(timings) * 0.95) - 1]:8.2f} ms  hits {hits}'
+                )
+        finally:
+            if options['seed'] and not options['keep']:
+                Food.objects.filter(description__startswith=SEED_MARKER).delete()
+                # Only the configured backend follows the deletes
+                search.TokenIndexBackend().rebuild()
+                search.DatabaseSearchBackend().rebuild()
+
+    def seed(self, count, rng):
+        foods = [
+            Food(
+                name=' '.join(rng.sample(self.words, 3)),
+                description=f'{SEED_MARKER} ' + ' '.join(rng.choices(self.words, k=12)),
+                price=rng.randint(5, 100),
+            )
+            for _ in range(count)
+        ]
+        # bulk_create skips the Food signals, rebuild the indexes once instead
+        Food.objects.bulk_create(foods, batch_size=1000)
+        for backend in (search.TokenIndexBackend(), search.DatabaseSearchBackend(), search.get_backend()):
+            backend.rebuild()
+
+    def make_queries(self, count, rng):
+        # Exact words, accent-free words ("pho") and words with a typo ("pizaa")
+        queries = []
+        for _ in range(count):
+            word = rng.choice(self.words)
+            kind = rng.randrange(3)
+            if kind == 1:
+                word = search.fold(word)
+            elif kind == 2 and len(word) > 3:
+                i = rng.randrange(len(word))
+                word = word[:i] + word[i + 1:]
+            queries.append(word)
+        return queries
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from main.benchmark import data, journey, report
+from main.models import User
+import random
+import time
+
+class Command(BaseCommand):
+    help = (
+        'Load test the storefront: seed a synthetic dataset, run scripted customer journeys '
+        '(browse, search, details, cart, checkout, fake payment) and report the latency of every route.'
+    )
+
+    def add_arguments(self, parser):
+        defaults = data.Scale()
+        parser.add_argument('--foods', type=int, default=defaults.foods)
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--reviews', type=int, default=defaults.reviews)
+        parser.add_argument('--replies', type=int, default=defaults.replies)
+        parser.add_argument('--orders', type=int, default=defaults.orders)
+        parser.add_argument('--journeys', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=1, help='Threads (wsgi) or tasks (asgi).')
+        parser.add_argument('--driver', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the dataset and of the journeys.')
+        parser.add_argument('--output', help='Save the results to this JSON file.')
+        parser.add_argument('--compare', help='Compare with the results saved by a previous run.')
+        parser.add_argument('--reuse', action='store_true', help='Use the dataset left by a previous run with --keep.')
+        parser.add_argument('--keep', action='store_true', help='Keep the dataset afterwards.')
+
+    def handle(self, *args, **options):
+        previous = report.load(options['compare']) if options['compare'] else None
+        rng = random.Random(options['seed'])
+        scale = data.Scale(
+            options['foods'], options['users'], options['reviews'], options['replies'], options['orders'],
+        )
+
+        if options['reuse']:
+            users = list(User.objects.filter(email__endswith=f'@{data.EMAIL_DOMAIN}').order_by('id'))
+            if not users:
+                raise CommandError('No dataset to reuse, run once with --keep first.')
+        else:
+            self.stdout.write(f'Seeding {scale}...')
+            users = data.generate(scale, rng)
+
+        try:
+            journeys = [journey.customer_journey(random.Random(rng.random()), data.WORDS) for _ in range(options['journeys'])]
+            run = journey.run_asgi if options['driver'] == 'asgi' else journey.run_wsgi
+            recorder = report.Recorder()
+            with override_settings(
+                PAYMENT_GATEWAY='main.utils.payments.FakeGateway',
+                ALLOWED_HOSTS=['testserver'],
+            ):
+                start = time.perf_counter()
+                run(users, journeys, recorder, options['concurrency'])
+                elapsed = time.perf_counter() - start
+        finally:
+            if not options['keep']:
+                data.cleanup()
+
+        summary = recorder.summary(
+            elapsed,
+            driver=options['driver'],
+            concurrency=options['concurrency'],
+            journeys=options['journeys'],
+            scale=scale._asdict(),
+        )
+        for line in report.format_table(summary):
+            self.stdout.write(line)
+        if summary['aborted_journeys']:
+            self.stdout.write(self.style.WARNING(f'Aborted journeys: {summary["aborted_journeys"]}'))
+        if previous:
+            for line in report.format_comparison(summary, previous):
+                self.stdout.write(line)
+        if options['output']:
+            report.save(summary, options['output'])
+            self.stdout.write(self.style.SUCCESS(f'Saved to {options["output"]}'))
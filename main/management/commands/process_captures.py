@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from main.models import CaptureJob
+import time
+
+class Command(BaseCommand):
+    help = 'Capture the queued payments and update the status of their orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Process the due jobs and exit.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = CaptureJob.objects.process_batch(options['batch_size'], options['max_attempts'])
+            total += processed
+            if processed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} capture job(s).'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from main.models import Food
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating aggregates of every food from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('food_ids', nargs='*', type=int, help='Only rebuild these foods.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        food_ids = options['food_ids'] or None
+        updated = Food.objects.rebuild_rating_aggregates(food_ids=food_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates of {updated} food(s).'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from main.utils import search
+
+class Command(BaseCommand):
+    help = 'Rebuild the index of the configured SEARCH_BACKEND.'
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the {type(backend).__name__} search index.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from main.models import Food
+from main.utils import page_cache
+
+class Command(BaseCommand):
+    help = 'Recompute the order count of every food from the items of the purchased bills.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = Food.objects.rebuild_order_counts(batch_size=options['batch_size'])
+        # The best sellers of the menu may have changed
+        page_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled the order counts of {updated} food(s).'))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+import contextlib
+import random
+import time
+from .utils import timing
+
+class TimingMiddleware:
+    '''
+    Times a sample of the requests: query count, SQL time, template render time and total time.
+    They are sent in a Server-Timing header and aggregated by route for the `metrics` view.
+    REQUEST_TIMING_SAMPLE_RATE is the sampled fraction of the requests; 0 unloads the middleware.
+    '''
+    def __init__(self, get_response):
+        self.sample_rate = settings.REQUEST_TIMING_SAMPLE_RATE
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timings, token = timing.start()
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute))
+                response = self.get_response(request)
+        finally:
+            timing.stop(token)
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = (match.url_name or match.route) if match else 'unmatched'
+        timing.metrics.observe(route, request.method, timings, total)
+        response['Server-Timing'] = timings.server_timing(total)
+        return response
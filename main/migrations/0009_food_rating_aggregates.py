@@ -0,0 +1,80 @@
+# Generated by Django 3.1.14 on 2026-10-17 17:54
+
+from django.db import migrations, models
+from django.db.models import Count
+import collections
+
+
+def populate_rating_aggregates(apps, schema_editor):
+    Food = apps.get_model('main', 'Food')
+    Review = apps.get_model('main', 'Review')
+    stats = collections.defaultdict(dict)
+    for row in Review.objects.filter(food__isnull=False).values('food_id', 'rating').annotate(total=Count('id')).order_by():
+        stats[row['food_id']][row['rating']] = row['total']
+
+    foods = []
+    for food in Food.objects.filter(id__in=stats.keys()):
+        per_star = stats[food.id]
+        food.rating_count = sum(per_star.values())
+        food.rating_sum = sum(star * total for star, total in per_star.items())
+        food.avg_rating = food.rating_sum / food.rating_count
+        for star in range(1, 6):
+            setattr(food, f'star{star}_count', per_star.get(star, 0))
+        foods.append(food)
+    fields = ['rating_count', 'rating_sum', 'avg_rating'] + [f'star{star}_count' for star in range(1, 6)]
+    Food.objects.bulk_update(foods, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_user_food_saved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='avg_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='star1_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='star2_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='star3_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='star4_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='star5_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['-avg_rating', 'id'], name='food_avg_rating_idx'),
+        ),
+        migrations.RunPython(populate_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+import unicodedata
+
+# A copy of `main.utils.search.fold` as of this migration: the signals store folded text
+FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'D'})
+
+def fold(text):
+    text = unicodedata.normalize('NFKD', (text or '').translate(FOLD_TABLE))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE main_food ADD FULLTEXT INDEX food_fulltext_idx (name, description)')
+    elif vendor == 'sqlite':
+        # Rows are kept in sync by the Food signals (see main.utils.search)
+        schema_editor.execute('CREATE VIRTUAL TABLE main_food_fts USING fts5(name, description)')
+        Food = apps.get_model('main', 'Food')
+        rows = [(food_id, fold(name), fold(description)) for food_id, name, description in Food.objects.values_list('id', 'name', 'description')]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO main_food_fts (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE main_food DROP INDEX food_fulltext_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE main_food_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_food_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 3.1.14 on 2026-10-17 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import collections
+import re
+import unicodedata
+
+# Copies of the `main.utils.search` helpers as of this migration, which must not change with that module
+TOKEN_PATTERN = re.compile(r'\w+')
+FTS_TABLE = 'main_food_fts'
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_TOKEN_LENGTH = 64
+FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'D'})
+
+def fold(text):
+    text = unicodedata.normalize('NFKD', (text or '').translate(FOLD_TABLE))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(fold(text))
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def token_weights(name, description):
+    weights = collections.defaultdict(float)
+    for token in tokenize(name):
+        weights[token[:MAX_TOKEN_LENGTH]] += NAME_WEIGHT
+    for token in tokenize(description):
+        weights[token[:MAX_TOKEN_LENGTH]] += DESCRIPTION_WEIGHT
+    return weights
+
+
+def index_existing_foods(apps, schema_editor):
+    Food = apps.get_model('main', 'Food')
+    SearchToken = apps.get_model('main', 'SearchToken')
+    SearchTrigram = apps.get_model('main', 'SearchTrigram')
+    is_sqlite = schema_editor.connection.vendor == 'sqlite'
+    for food in Food.objects.only('id', 'name', 'description').iterator():
+        weights = token_weights(food.name, food.description)
+        SearchToken.objects.bulk_create([SearchToken(food_id=food.id, token=token, weight=weight) for token, weight in weights.items()])
+        SearchTrigram.objects.bulk_create(
+            [SearchTrigram(trigram=trigram, token=token) for token in weights for trigram in trigrams(token)],
+            ignore_conflicts=True,
+        )
+        if is_sqlite:
+            # Folded already by 0010, unless it ran before 0010 folded its rows
+            schema_editor.execute(
+                f'UPDATE {FTS_TABLE} SET name = %s, description = %s WHERE rowid = %s',
+                [fold(food.name), fold(food.description), food.id],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_food_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('token', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchtrigram',
+            constraint=models.UniqueConstraint(fields=('trigram', 'token'), name='unique_trigram_token'),
+        ),
+        migrations.AddField(
+            model_name='searchtoken',
+            name='food',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.food'),
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['token', 'food', 'weight'], name='search_token_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchtoken',
+            constraint=models.UniqueConstraint(fields=('food', 'token'), name='unique_food_token'),
+        ),
+        migrations.RunPython(index_existing_foods, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_cart_owners(apps, schema_editor):
+    Bill = apps.get_model('main', 'Bill')
+    Item = apps.get_model('main', 'Item')
+    carts = {}
+    for bill in Bill.objects.filter(status__name='cart', user__isnull=False).order_by('order_date', 'id'):
+        if bill.user_id in carts:
+            # Only one cart per user from now on: keep the oldest, move the items of the others into it
+            Item.objects.filter(bill=bill).update(bill=carts[bill.user_id])
+        else:
+            carts[bill.user_id] = bill
+    for bill in carts.values():
+        bill.cart_owner_id = bill.user_id
+    Bill.objects.bulk_update(carts.values(), ['cart_owner'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_search_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='cart_owner',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_cart_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_bill_cart_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaptureJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=255)),
+                ('signature', models.CharField(max_length=255)),
+                ('amount', models.FloatField()),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bill', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='main.bill')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='capturejob',
+            index=models.Index(fields=['state', 'run_after'], name='capture_job_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_capture_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='order_token',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
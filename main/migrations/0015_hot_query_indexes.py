@@ -0,0 +1,65 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:24
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicates(apps, schema_editor):
+    Coupon = apps.get_model('main', 'Coupon')
+    Item = apps.get_model('main', 'Item')
+
+    # Duplicated coupon codes: the newest coupon keeps the code, the others are renamed and deactivated
+    codes = Coupon.objects.values('code').annotate(total=Count('id')).filter(total__gt=1).values_list('code', flat=True)
+    for code in list(codes):
+        for coupon in Coupon.objects.filter(code=code).order_by('-start', '-id')[1:]:
+            suffix = f'~{coupon.id}'
+            coupon.code = coupon.code[:50 - len(suffix)] + suffix
+            coupon.is_active = False
+            coupon.save()
+
+    # The same food twice in a bill: merged into the first item
+    pairs = (
+        Item.objects.filter(bill__isnull=False, food__isnull=False)
+        .values('bill_id', 'food_id').annotate(total=Count('id')).filter(total__gt=1)
+    )
+    for pair in list(pairs):
+        items = list(Item.objects.filter(bill_id=pair['bill_id'], food_id=pair['food_id']).order_by('id'))
+        items[0].quantity = sum(item.quantity for item in items)
+        items[0].save()
+        Item.objects.filter(id__in=[item.id for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_bill_order_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['user', 'status'], name='bill_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['rzp_id'], name='bill_rzp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['parent', 'date_created'], name='reply_parent_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['food', '-date_created'], name='review_food_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(fields=('bill', 'food'), name='unique_bill_food'),
+        ),
+    ]
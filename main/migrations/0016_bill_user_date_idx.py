@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['user', '-order_date', '-id'], name='bill_user_date_idx'),
+        ),
+    ]
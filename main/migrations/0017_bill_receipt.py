@@ -0,0 +1,68 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:48
+
+from django.db import migrations, models
+from django.db.models import Prefetch
+from django.utils import timezone
+
+# Copies of the `main.utils.receipts` helpers as of this migration, which must not change with that module
+VERSION = 1
+RECEIPT_STATUSES = ('purchased', 'cancelled')
+
+def snapshot(bill):
+    items = [
+        {
+            'food_id': item.food_id,
+            'name': item.food.name if item.food else '',
+            'quantity': item.quantity,
+            'unit_price': item.unit_price,
+        }
+        for item in bill.item_set.all()
+    ]
+    coupon = None
+    if bill.coupon_id:
+        coupon = {'code': bill.coupon.code, 'value': bill.coupon.value}
+    return {
+        'version': VERSION,
+        'created': timezone.now().isoformat(),
+        'items': items,
+        'subtotal': round(sum(item['quantity'] * item['unit_price'] for item in items), 2),
+        'coupon': coupon,
+        'delivery_charges': float(bill.delivery_charges),
+        'total': bill.total,
+    }
+
+
+def snapshot_final_bills(apps, schema_editor):
+    Bill = apps.get_model('main', 'Bill')
+    Item = apps.get_model('main', 'Item')
+
+    # The receipts of the bills already purchased or cancelled, from their current items
+    bills = (
+        Bill.objects.select_related('coupon')
+        .prefetch_related(Prefetch('item_set', queryset=Item.objects.select_related('food')))
+    )
+    ids = list(
+        Bill.objects.filter(status__name__in=RECEIPT_STATUSES, receipt__isnull=True)
+        .values_list('id', flat=True)
+    )
+    for start in range(0, len(ids), 500):
+        batch = list(bills.filter(id__in=ids[start:start + 500]))
+        for bill in batch:
+            bill.receipt = snapshot(bill)
+        Bill.objects.bulk_update(batch, ['receipt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_bill_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='receipt',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(snapshot_final_bills, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_bill_receipt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='use_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-17 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_coupon_usage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['-order_count', 'id'], name='food_order_count_idx'),
+        ),
+    ]
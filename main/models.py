@@ -1,14 +1,22 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.db.models.deletion import SET_NULL
 from django.db.models.fields import BooleanField, SmallIntegerField, TextField
 from django.urls import reverse
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import MaxValueValidator, MinValueValidator 
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models import Case, Count, F, FloatField, Prefetch, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_save, pre_delete, post_delete, post_migrate
 from django.dispatch import receiver
+from asgiref.sync import async_to_sync
+import datetime
 import uuid
 import collections
+import math
+from .utils import coupons, fragments, page_cache, payments, pricing, receipts, search
+from .utils.constant import StatusName
+from .utils.statuses import get_status, registry as status_registry
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None):
@@ -82,26 +90,259 @@ class User(AbstractUser):
         """String for representing the User Model object."""
         return f'{self.last_name} {self.first_name}' if self.last_name and self.first_name else self.username
 
-@receiver(post_save, sender=User)
-def create_cart(sender, instance, created, **kwargs):
-    # Create a bill with `cart` status for new user
-    if created:
-        status, notExist = Status.objects.get_or_create(name='cart')
-        Bill.objects.create(user=instance, status=status)
+class FoodManager(models.Manager):
+    def apply_rating(self, food_id, rating, sign=1):
+        """
+        Adds (sign=1) or removes (sign=-1) one rating from the stored aggregates of a food.
+        """
+        rating = int(rating)
+        # `avg_rating` goes first: MySQL evaluates SET assignments left to right
+        # with already updated values, so it must still see the old sum and count.
+        changes = {
+            'avg_rating': Coalesce(
+                Cast(F('rating_sum') + sign * rating, FloatField()) / NullIf(F('rating_count') + sign, 0),
+                Value(0.0),
+            ),
+            'rating_count': F('rating_count') + sign,
+            'rating_sum': F('rating_sum') + sign * rating,
+        }
+        if rating in Food.STARS:
+            star_field = Food.star_field(rating)
+            changes[star_field] = F(star_field) + sign
+        return self.filter(id=food_id).update(**changes)
+
+    def rebuild_rating_aggregates(self, food_ids=None, batch_size=500):
+        """
+        Recomputes the stored rating aggregates from the Review table.
+        Needed after bulk imports or raw edits, which bypass the Review signals.
+        """
+        foods = self.all() if food_ids is None else self.filter(id__in=food_ids)
+        reviews = Review.objects.filter(food__isnull=False)
+        if food_ids is not None:
+            reviews = reviews.filter(food_id__in=food_ids)
+
+        # How many reviews per (food, star)?
+        stats = collections.defaultdict(dict)
+        for row in reviews.values('food_id', 'rating').annotate(total=Count('id')).order_by():
+            stats[row['food_id']][row['rating']] = row['total']
+
+        fields = ['rating_count', 'rating_sum', 'avg_rating'] + [Food.star_field(star) for star in Food.STARS]
+        batch, updated = [], 0
+        for food in foods.only('id').iterator():
+            per_star = stats.get(food.id, {})
+            food.rating_count = sum(per_star.values())
+            food.rating_sum = sum(star * total for star, total in per_star.items())
+            food.avg_rating = food.rating_sum / food.rating_count if food.rating_count else 0
+            for star in Food.STARS:
+                setattr(food, Food.star_field(star), per_star.get(star, 0))
+            batch.append(food)
+            if len(batch) >= batch_size:
+                self.bulk_update(batch, fields)
+                updated += len(batch)
+                batch = []
+        if batch:
+            self.bulk_update(batch, fields)
+            updated += len(batch)
+        return updated
+
+    def count_orders(self, items, sign=1):
+        """
+        Adds (sign=1) or removes (sign=-1) the quantities of the items to the order counts of their foods.
+        One UPDATE of F() increments, whatever the number of foods.
+        """
+        quantities = collections.Counter()
+        for item in items:
+            if item.food_id:
+                quantities[item.food_id] += item.quantity
+        if not quantities:
+            return 0
+        increment = Case(
+            *[When(id=food_id, then=Value(sign * quantity)) for food_id, quantity in quantities.items()],
+            default=Value(0), output_field=models.IntegerField(),
+        )
+        return self.filter(id__in=quantities.keys()).update(order_count=F('order_count') + increment)
+
+    def rebuild_order_counts(self, batch_size=500):
+        """
+        Recomputes the order counts from the items of the purchased bills, `batch_size` foods at a time.
+        Needed after bulk imports or raw edits of the bills.
+        """
+        items = Item.objects.filter(bill__status__name=StatusName.PURCHASED)
+        updated, last_id = 0, 0
+        while True:
+            foods = list(self.filter(id__gt=last_id).order_by('id').only('id')[:batch_size])
+            if not foods:
+                return updated
+            last_id = foods[-1].id
+            quantities = dict(
+                items.filter(food_id__in=[food.id for food in foods])
+                .values_list('food_id').annotate(total=Sum('quantity')).order_by()
+            )
+            for food in foods:
+                food.order_count = quantities.get(food.id, 0)
+            self.bulk_update(foods, ['order_count'])
+            updated += len(foods)
 
 class Food(models.Model):
+    STARS = (1, 2, 3, 4, 5)
+
     name = models.CharField(max_length=45)
     description = models.TextField(null=True, blank=True)
     price = models.FloatField()
     discount = models.FloatField(null=True, blank=True)
+    # Quantity sold in purchased bills, maintained by CaptureJobManager.process_batch and cancel_order
     order_count = models.IntegerField(default=0)
+    # Rating aggregates, maintained by the Review signals below
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    avg_rating = models.FloatField(default=0)
+    star1_count = models.IntegerField(default=0)
+    star2_count = models.IntegerField(default=0)
+    star3_count = models.IntegerField(default=0)
+    star4_count = models.IntegerField(default=0)
+    star5_count = models.IntegerField(default=0)
+
+    objects = FoodManager()
 
     def __str__(self):
         """String for representing the Model object."""
         return self.name
+
+    @staticmethod
+    def star_field(star):
+        """Name of the field counting reviews with the given star."""
+        return f'star{star}_count'
         
     class Meta:
         verbose_name_plural = "foods"
+        indexes = [
+            models.Index(fields=['-avg_rating', 'id'], name='food_avg_rating_idx'),
+            # Best sellers of the menu
+            models.Index(fields=['-order_count', 'id'], name='food_order_count_idx'),
+        ]
+
+class SearchTokenManager(models.Manager):
+    def index_food(self, food):
+        """
+        Replaces the tokens of one food, registers the trigrams of the new tokens
+        and removes those of the tokens no food uses anymore.
+        """
+        weights = search.token_weights(food.name, food.description)
+        old_tokens = set(self.filter(food=food).values_list('token', flat=True))
+        self.filter(food=food).delete()
+        self.bulk_create([SearchToken(food=food, token=token, weight=weight) for token, weight in weights.items()])
+        SearchTrigram.objects.register(weights.keys() - old_tokens)
+        SearchTrigram.objects.remove_unused(old_tokens - weights.keys())
+
+    def remove_food(self, food_id):
+        """Removes the tokens of one food and the trigrams of the tokens no other food uses."""
+        tokens = set(self.filter(food_id=food_id).values_list('token', flat=True))
+        self.filter(food_id=food_id).delete()
+        SearchTrigram.objects.remove_unused(tokens)
+
+    def rebuild(self, batch_size=1000):
+        """
+        Rebuilds the token and trigram tables from the Food table.
+        """
+        self.all().delete()
+        SearchTrigram.objects.all().delete()
+        tokens = []
+        for food in Food.objects.only('id', 'name', 'description').iterator():
+            weights = search.token_weights(food.name, food.description)
+            tokens.extend(SearchToken(food_id=food.id, token=token, weight=weight) for token, weight in weights.items())
+            if len(tokens) >= batch_size:
+                self.bulk_create(tokens)
+                SearchTrigram.objects.register({token.token for token in tokens})
+                tokens = []
+        self.bulk_create(tokens)
+        SearchTrigram.objects.register({token.token for token in tokens})
+
+class SearchToken(models.Model):
+    """Accent-folded token of a food name or description (see main.utils.search)."""
+    food = models.ForeignKey('Food', on_delete=models.CASCADE)
+    token = models.CharField(max_length=search.MAX_TOKEN_LENGTH)
+    weight = models.FloatField()
+
+    objects = SearchTokenManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['food', 'token'], name='unique_food_token'),
+        ]
+        indexes = [
+            # Covers the whole ranking query of TokenIndexBackend
+            models.Index(fields=['token', 'food', 'weight'], name='search_token_idx'),
+        ]
+
+class SearchTrigramManager(models.Manager):
+    def register(self, tokens):
+        self.bulk_create(
+            [SearchTrigram(trigram=trigram, token=token) for token in tokens for trigram in search.trigrams(token)],
+            ignore_conflicts=True,
+        )
+
+    def remove_unused(self, tokens):
+        """Removes the trigrams of the tokens that are not in the SearchToken table anymore."""
+        used = set(SearchToken.objects.filter(token__in=tokens).values_list('token', flat=True).distinct())
+        unused = set(tokens) - used
+        if unused:
+            # By trigram too: the unique (trigram, token) index is the only one
+            trigrams = {trigram for token in unused for trigram in search.trigrams(token)}
+            self.filter(trigram__in=trigrams, token__in=unused).delete()
+
+    def similar_tokens(self, term, threshold):
+        """
+        Yields (token, similarity) for the indexed tokens sharing enough trigrams with `term`.
+        """
+        term_trigrams = search.trigrams(term)
+        # similarity = shared / (|term| + |token| - shared) >= threshold implies shared >= threshold * |term|
+        min_shared = max(1, math.ceil(threshold * len(term_trigrams)))
+        rows = self.filter(trigram__in=term_trigrams).values('token').annotate(shared=Count('id')).filter(shared__gte=min_shared)
+        for row in rows:
+            similarity = row['shared'] / (len(term_trigrams) + len(search.trigrams(row['token'])) - row['shared'])
+            if similarity >= threshold:
+                yield row['token'], similarity
+
+class SearchTrigram(models.Model):
+    """Trigram of an indexed token, for typo-tolerant lookups."""
+    trigram = models.CharField(max_length=3)
+    token = models.CharField(max_length=search.MAX_TOKEN_LENGTH)
+
+    objects = SearchTrigramManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trigram', 'token'], name='unique_trigram_token'),
+        ]
+
+@receiver(post_save, sender=Food)
+def index_food(sender, instance, **kwargs):
+    # Keep the index of the menu search backend in sync with the food
+    search.get_backend().index_food(instance)
+
+@receiver(pre_delete, sender=Food)
+def remove_food_from_index(sender, instance, **kwargs):
+    # Before the cascade: TokenIndexBackend reads the tokens of the food to remove their unused trigrams
+    search.get_backend().remove_food(instance.id)
+
+@receiver(post_save, sender=Food)
+@receiver(post_delete, sender=Food)
+def invalidate_food_caches(sender, instance, **kwargs):
+    # The cached menu card and details header of the food, the menu pages and its details page
+    fragments.invalidate(instance.id)
+    page_cache.invalidate(instance.id)
+
+class ReviewQuerySet(models.QuerySet):
+    def delete(self):
+        """Deletes the reviews, then rebuilds the rating aggregates of their foods once per food."""
+        food_ids = set(self.filter(food__isnull=False).values_list('food_id', flat=True).order_by().distinct())
+        with transaction.atomic():
+            deleted = super().delete()
+            remove_reviews(food_ids)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 class Review(models.Model):
     comment = models.TextField()
@@ -109,15 +350,109 @@ class Review(models.Model):
     user = models.ForeignKey('User', on_delete=models.CASCADE, null=True)
     food = models.ForeignKey('Food', on_delete=models.CASCADE, null=True)
     date_created = models.DateTimeField(default=timezone.now)
-    
+
+    objects = ReviewQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The reviews of a food, newest first
+            models.Index(fields=['food', '-date_created'], name='review_food_date_idx'),
+        ]
+
+    def delete(self, *args, **kwargs):
+        """Deletes the review and removes its rating from the aggregates of its food."""
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            if self.food_id:
+                Food.objects.apply_rating(self.food_id, self.rating, sign=-1)
+        if self.food_id:
+            fragments.invalidate(self.food_id)
+            page_cache.invalidate(self.food_id)
+        return deleted
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    # Keep the rating aggregates of the reviewed food up to date
+    if not instance.food_id:
+        return
+    if created:
+        Food.objects.apply_rating(instance.food_id, instance.rating)
+    else:
+        # The previous rating is unknown here, recompute this food only
+        Food.objects.rebuild_rating_aggregates(food_ids=[instance.food_id])
+
+@receiver(post_save, sender=Review)
+def invalidate_reviewed_food_caches(sender, instance, **kwargs):
+    # The stars of the food changed
+    if instance.food_id:
+        fragments.invalidate(instance.food_id)
+        page_cache.invalidate(instance.food_id)
+
+# No post_delete receiver for Review: deleting a food or a user would send it for each of their
+# reviews. Review.delete and ReviewQuerySet.delete update the aggregates once per food, and the
+# reviews of a deleted food need nothing.
+
+def remove_reviews(food_ids):
+    """Rebuilds the rating aggregates of the foods whose reviews were deleted, and their caches."""
+    if food_ids:
+        Food.objects.rebuild_rating_aggregates(food_ids=food_ids)
+    for food_id in food_ids:
+        fragments.invalidate(food_id)
+        page_cache.invalidate(food_id)
+
+@receiver(pre_delete, sender=User)
+def delete_user_reviews(sender, instance, **kwargs):
+    # The cascade deletes the user before its reviews: delete them first, so their foods are
+    # rebuilt from the remaining reviews. The cascade then finds them already deleted.
+    Review.objects.filter(user=instance).delete()
+
+class ReplyQuerySet(models.QuerySet):
+    def delete(self):
+        """Deletes the replies, then drops the details pages of the foods of their reviews."""
+        food_ids = set(self.filter(parent__food__isnull=False).values_list('parent__food_id', flat=True).order_by().distinct())
+        deleted = super().delete()
+        for food_id in food_ids:
+            page_cache.invalidate(food_id, menu=False)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 class Reply(models.Model):
     user = models.ForeignKey('User', on_delete=models.CASCADE, null=True)
     parent = models.ForeignKey('Review', on_delete=models.CASCADE, null=True)
     content = models.TextField()
     date_created = models.DateTimeField(default=timezone.now)
+
+    objects = ReplyQuerySet.as_manager()
     
     class Meta:
         verbose_name_plural = "replies"
+        indexes = [
+            models.Index(fields=['parent', 'date_created'], name='reply_parent_date_idx'),
+        ]
+
+    def get_food_id(self):
+        """The id of the food of the review replied to, or None."""
+        return self.parent.food_id if self.parent_id else None
+
+    def delete(self, *args, **kwargs):
+        """Deletes the reply and drops the details page of the food of its review."""
+        food_id = self.get_food_id()
+        deleted = super().delete(*args, **kwargs)
+        if food_id:
+            page_cache.invalidate(food_id, menu=False)
+        return deleted
+
+# No post_delete receiver for Reply: it would prevent the fast cascade delete of the replies
+# of a review. Reply.delete and ReplyQuerySet.delete drop the details page instead, and the
+# review deleted with its replies drops it too.
+@receiver(post_save, sender=Reply)
+def invalidate_replied_food_page(sender, instance, **kwargs):
+    # Only the details page shows the replies
+    food_id = instance.get_food_id()
+    if food_id:
+        page_cache.invalidate(food_id, menu=False)
 
 class Image(models.Model):
     food = models.ForeignKey('Food', on_delete=models.CASCADE, null=True, blank=True)
@@ -127,17 +462,58 @@ class Image(models.Model):
         """String for representing the Model object."""
         return self.url
 
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def invalidate_image_food_caches(sender, instance, **kwargs):
+    if instance.food_id:
+        fragments.invalidate(instance.food_id)
+        page_cache.invalidate(instance.food_id)
+
+class CouponManager(models.Manager):
+    def valid(self, now=None):
+        """The active coupons whose validity period contains `now`."""
+        now = now or timezone.now()
+        return self.filter(models.Q(end__isnull=True) | models.Q(end__gt=now), is_active=True, start__lte=now)
+
+    def available(self, now=None):
+        """The valid coupons with uses left."""
+        return self.valid(now).filter(models.Q(max_uses__isnull=True) | models.Q(use_count__lt=F('max_uses')))
+
+    def redeem(self, coupon_id):
+        """
+        Counts one use of a coupon, if it is still valid and has uses left. Returns whether it did.
+        A single conditional UPDATE: no row is read and locked beforehand.
+        """
+        return bool(self.available().filter(id=coupon_id).update(use_count=F('use_count') + 1))
+
+    def release(self, coupon_id, uses=1):
+        """
+        Gives back `uses` uses of a coupon, counted by orders that were cancelled or whose payment failed.
+        Call it only when the status of these orders was changed by a conditional UPDATE, so they are released once.
+        """
+        return self.filter(id=coupon_id, use_count__gte=uses).update(use_count=F('use_count') - uses)
+
 class Coupon(models.Model):
-    code = models.CharField(max_length=50)
+    code = models.CharField(max_length=50, unique=True)
     value = models.FloatField()
     start = models.DateTimeField()
     end = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # Orders that can be placed with the coupon, unlimited if empty
+    max_uses = models.PositiveIntegerField(null=True, blank=True)
+    use_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CouponManager()
 
     def __str__(self):
         """String for representing the Model object."""
         return self.code
 
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_coupons(sender, **kwargs):
+    coupons.registry.invalidate()
+
 class Status(models.Model):
     name = models.CharField(unique=True, null=True, max_length=50)
     description = models.CharField(null=True, blank=True, max_length=255)
@@ -149,6 +525,93 @@ class Status(models.Model):
     class Meta:
         verbose_name_plural = "statuses"
 
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def invalidate_statuses(sender, **kwargs):
+    status_registry.invalidate()
+
+@receiver(post_migrate)
+def invalidate_registries_after_migrate(sender, **kwargs):
+    # `flush` empties the tables without sending post_delete
+    status_registry.invalidate()
+    coupons.registry.invalidate()
+
+class BillManager(models.Manager):
+    def get_or_create_cart(self, user):
+        """
+        Returns the bill with the `cart` status of a user, created on first use.
+        The unique `cart_owner` makes concurrent calls return the same bill.
+        """
+        bill, created = self.get_or_create(
+            cart_owner=user,
+            defaults={'user': user, 'status': get_status(StatusName.CART)},
+        )
+        return bill
+
+    def place_order(self, cart, token, **fields):
+        """
+        Turns a cart into an order in place, with a single UPDATE: the items stay where they are.
+        The total of the order is computed from its items. Returns the order placed with `token`, or None if the cart is no longer a cart.
+        Retrying with the same token returns the same order.
+        Counts a use of the coupon of the cart; raises CouponUnavailable if it has none left.
+        """
+        order = self.filter(order_token=token).first()
+        if order is not None or cart is None:
+            return order
+        fields.update(
+            # From the items in the database, not from the checkout form
+            total=float(pricing.get_totals(cart).total),
+            status=get_status(StatusName.PROCESSING),
+            order_token=token,
+            order_date=timezone.now(),
+            cart_owner=None,
+        )
+        try:
+            with transaction.atomic():
+                updated = self.filter(id=cart.id, cart_owner__isnull=False).update(**fields)
+                # Last: the coupon row stays locked until the commit
+                if updated and cart.coupon_id and not Coupon.objects.redeem(cart.coupon_id):
+                    raise coupons.CouponUnavailable(cart.coupon_id)
+        except IntegrityError:
+            # Another request placed an order with this token in the meantime
+            return self.filter(order_token=token).first()
+        if not updated:
+            return self.filter(order_token=token).first()
+        for name, value in fields.items():
+            setattr(cart, name, value)
+        return cart
+
+    def cancel(self, bill):
+        """
+        Cancels a bill with conditional UPDATEs: of two concurrent cancels, only one changes its status.
+        Removes the items of a purchased bill from the order counts, gives back the coupon use of an order
+        placed or purchased, and drops the pending capture of its payment.
+        Uses the prefetched items of the bill. Returns whether the bill was cancelled.
+        """
+        processing, purchased = get_status(StatusName.PROCESSING), get_status(StatusName.PURCHASED)
+        cancelled = get_status(StatusName.CANCELLED)
+        bills = self.filter(id=bill.id)
+        fields = dict(status=cancelled, cart_owner=None, receipt=bill.receipt or receipts.snapshot(bill))
+        with transaction.atomic():
+            # Not purchased first: a bill being captured is locked by the worker, and these
+            # UPDATEs see its new status once the capture is committed
+            placed = bills.filter(status=processing).update(**fields)
+            # A cart, or an order whose payment failed: its coupon use was not counted or given back already
+            other = not placed and bills.exclude(status__in=[processing, purchased, cancelled]).update(**fields)
+            # The receipt was written when purchased
+            sold = not (placed or other) and bills.filter(status=purchased).update(status=cancelled)
+            if sold:
+                # Not sold anymore
+                Food.objects.count_orders(bill.item_set.all(), sign=-1)
+            if (placed or sold) and bill.coupon_id:
+                Coupon.objects.release(bill.coupon_id)
+            # Not captured anymore. A job already claimed by the worker fails: the bill is not processing
+            CaptureJob.objects.filter(bill=bill, state=CaptureJob.PENDING).delete()
+        if not (placed or other or sold):
+            return False
+        bill.status = cancelled
+        return True
+
 class Bill(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     total = models.FloatField(default=0)
@@ -168,14 +631,170 @@ class Bill(models.Model):
     rzp_id = models.CharField(max_length=255, default='')
     rzp_payment_id = models.CharField(max_length=255, default='')
     rzp_signature = models.CharField(max_length=255, default='')
+    # Set to `user` while the bill is a cart: a user has at most one cart
+    cart_owner = models.OneToOneField('User', on_delete=models.CASCADE, null=True, blank=True, editable=False, related_name='+')
+    # Sent with the checkout form: placing the same order twice returns the first one
+    order_token = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    # Snapshot of the items, prices and coupon, written once purchased or cancelled (see `main.utils.receipts`)
+    receipt = models.JSONField(null=True, blank=True, editable=False)
+
+    objects = BillManager()
 
     def __str__(self):
         """String for representing the Model object."""
         return str(self.id)
 
+    class Meta:
+        indexes = [
+            # Orders of a user (profile), payment callbacks
+            models.Index(fields=['user', 'status'], name='bill_user_status_idx'),
+            models.Index(fields=['rzp_id'], name='bill_rzp_id_idx'),
+            # Order history of the profile, newest first
+            models.Index(fields=['user', '-order_date', '-id'], name='bill_user_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        is_cart = self.status is not None and self.status.name == StatusName.CART
+        self.cart_owner_id = self.user_id if is_cart else None
+        # Once: a bill purchased or cancelled does not change anymore
+        is_final = self.status is not None and self.status.name in receipts.RECEIPT_STATUSES
+        if is_final and self.receipt is None and not self._state.adding:
+            self.receipt = receipts.snapshot(self)
+        super().save(*args, **kwargs)
+
 class Item(models.Model):
     unit_price = models.FloatField()
     quantity = models.IntegerField()
     note = models.TextField(null=True, blank=True)
     food = models.ForeignKey('Food', on_delete=models.CASCADE, null=True)
     bill = models.ForeignKey('Bill', on_delete=models.SET_NULL, null=True)
+
+    class Meta:
+        constraints = [
+            # A food is in a bill once, with a quantity
+            models.UniqueConstraint(fields=['bill', 'food'], name='unique_bill_food'),
+        ]
+
+class CaptureJobManager(models.Manager):
+    def enqueue(self, bill, payment_id, signature):
+        """
+        Queues the capture of the payment of a bill, one write.
+        A repeated callback for the same bill returns the job already queued.
+        A bill no longer processing, e.g. cancelled, gets no new job: None is returned, unless one was queued before.
+        """
+        if bill.status_id != get_status(StatusName.PROCESSING).id:
+            return self.filter(bill=bill).first()
+        job, created = self.get_or_create(
+            bill=bill,
+            defaults={'payment_id': payment_id, 'signature': signature, 'amount': bill.total},
+        )
+        return job
+
+    def process_batch(self, batch_size=50, max_attempts=5):
+        """
+        Captures up to `batch_size` due payments and returns the number of jobs processed.
+        Claimed jobs are leased: if the worker dies, another one picks them up when the lease expires.
+        A job whose bill is no longer processing fails without capturing anything.
+        A failed capture is retried with an exponential backoff, `max_attempts` times at most.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                self.select_for_update(skip_locked=True)
+                .filter(state=CaptureJob.PENDING, run_after__lte=now)
+                .order_by('run_after', 'id')[:batch_size]
+            )
+            self.filter(id__in=[job.id for job in jobs]).update(run_after=now + CaptureJob.LEASE)
+        if not jobs:
+            return 0
+
+        gateway = payments.get_gateway()
+        processing = get_status(StatusName.PROCESSING)
+        purchased, payment_failed = get_status(StatusName.PURCHASED), get_status(StatusName.PAYMENT_FAILED)
+        with transaction.atomic():
+            # Only the bills still waiting for their payment, locked until the commit: a bill cannot be cancelled
+            # while its payment is captured, and a bill cancelled or settled before is not captured.
+            # The items and coupon of the bills, for their receipts
+            bills = (
+                Bill.objects.select_for_update(of=('self',)).select_related('coupon')
+                .prefetch_related(Prefetch('item_set', queryset=Item.objects.select_related('food')))
+                .filter(status=processing)
+                .in_bulk([job.bill_id for job in jobs])
+            )
+            captured = []
+            for job in jobs:
+                if job.bill_id in bills:
+                    captured.append(job)
+                else:
+                    job.state = CaptureJob.FAILED
+                    job.last_error = 'The bill is no longer processing, the payment was not captured.'
+
+            # Concurrently: the bills stay locked for about one round trip to the gateway, not one per job
+            errors = async_to_sync(payments.capture_all)(gateway, [(job.payment_id, job.amount) for job in captured])
+            # The bills settled, the items they sold and the coupon uses of the failed payments
+            settled, sold, released = [], [], collections.Counter()
+            for job, error in zip(captured, errors):
+                job.attempts += 1
+                if error is None or isinstance(error, payments.AlreadyCaptured):
+                    # AlreadyCaptured: by a worker that died before saving the job
+                    job.state = CaptureJob.DONE
+                else:
+                    job.last_error = str(error)
+                    if job.attempts >= max_attempts:
+                        job.state = CaptureJob.FAILED
+                    else:
+                        job.run_after = timezone.now() + CaptureJob.BACKOFF * 2 ** (job.attempts - 1)
+                        continue
+
+                bill = bills[job.bill_id]
+                bill.rzp_payment_id = job.payment_id
+                bill.rzp_signature = job.signature
+                if job.state == CaptureJob.DONE:
+                    sold.extend(bill.item_set.all())
+                    bill.status = purchased
+                    bill.order_date = now
+                    if bill.receipt is None:
+                        bill.receipt = receipts.snapshot(bill)
+                else:
+                    bill.status = payment_failed
+                    if bill.coupon_id:
+                        released[bill.coupon_id] += 1
+                settled.append(bill)
+            self.bulk_update(jobs, ['state', 'attempts', 'run_after', 'last_error'])
+            Bill.objects.bulk_update(settled, ['status', 'order_date', 'rzp_payment_id', 'rzp_signature', 'receipt'])
+            for coupon_id, uses in released.items():
+                Coupon.objects.release(coupon_id, uses)
+            if Food.objects.count_orders(sold):
+                # The best sellers of the menu changed
+                page_cache.invalidate()
+        return len(jobs)
+
+class CaptureJob(models.Model):
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = ((PENDING, 'Pending'), (DONE, 'Done'), (FAILED, 'Failed'))
+    # How long a claimed job stays hidden from the other workers
+    LEASE = datetime.timedelta(minutes=5)
+    BACKOFF = datetime.timedelta(seconds=10)
+
+    bill = models.OneToOneField('Bill', on_delete=models.CASCADE)
+    payment_id = models.CharField(max_length=255)
+    signature = models.CharField(max_length=255)
+    amount = models.FloatField()
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_date = models.DateTimeField(default=timezone.now)
+
+    objects = CaptureJobManager()
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.payment_id} ({self.state})'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'run_after'], name='capture_job_queue_idx'),
+        ]
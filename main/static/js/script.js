@@ -60,6 +60,80 @@ $(document).ready(function(){
         element.scrollIntoView();
     }
 
+    // INFINITE SCROLL ON MENU
+    var menuMore = document.getElementById("menu-more");
+    if (menuMore && 'IntersectionObserver' in window) {
+        var loadingMenu = false;
+        var menuObserver = new IntersectionObserver(function(entries){
+            if (!entries[0].isIntersecting || loadingMenu) return;
+            loadingMenu = true;
+            $.ajax({
+                type: 'GET',
+                url: $(menuMore).data('url'),
+                dataType: 'json',
+                success: function(rs){
+                    $('.third-part').append(rs.html);
+                    if (rs.next_url) {
+                        $(menuMore).data('url', rs.next_url);
+                    }
+                    else {
+                        menuObserver.disconnect();
+                        menuMore.remove();
+                    }
+                },
+                error: function(rs, e){
+                    console.log("Error");
+                },
+                complete: function(){
+                    loadingMenu = false;
+                },
+            });
+        });
+        menuObserver.observe(menuMore);
+    }
+
+    // PROFILE SECTIONS: orders, reviews and comments, loaded page by page once visible
+    $('.profile-more').each(function(){
+        var more = $(this);
+        var loading = false;
+        var observer = null;
+        var loadPage = function(){
+            if (loading) return;
+            loading = true;
+            $.ajax({
+                type: 'GET',
+                url: more.data('url'),
+                dataType: 'json',
+                success: function(rs){
+                    $(more.data('target')).append(rs.html);
+                    if (rs.next_url) {
+                        more.data('url', rs.next_url);
+                    }
+                    else {
+                        if (observer) observer.disconnect();
+                        more.remove();
+                    }
+                },
+                error: function(rs, e){
+                    console.log("Error");
+                },
+                complete: function(){
+                    loading = false;
+                },
+            });
+        };
+        more.find('a').on('click', loadPage);
+        if ('IntersectionObserver' in window) {
+            observer = new IntersectionObserver(function(entries){
+                if (entries[0].isIntersecting) loadPage();
+            });
+            observer.observe(this);
+        }
+        else {
+            loadPage();
+        }
+    });
+
     // NAVBAR
     const navbar = document.querySelector('.mynavbar');
     window.onscroll = () => {
@@ -123,7 +197,7 @@ $(document).ready(function(){
     }
     
     // SUBMIT REPLY ON CLICK
-    $('[id^="submitReply"]').on('click', function(){
+    $(document).on('click', '[id^="submitReply"]', function(){
         localStorage.clear();
         var _reviewId = $(this).data('parent');
         var _content = $("#addReply" + _reviewId).val();
@@ -149,20 +223,44 @@ $(document).ready(function(){
         });
     });
     
-    // SCROLL INTO NEW REPLY
+    // SCROLL INTO NEW REPLY (its review may be on a page not loaded)
     if (localStorage.getItem("newReplyId")) {
         var _parentId = localStorage.getItem("parentId")
         $('#replyForm' + _parentId).attr('class', 'collapse in');
         $('#replyList' + _parentId).attr('class', 'collapse in');
         var _id = localStorage.getItem("newReplyId");
         e = document.getElementById(_id);
-        e.scrollIntoView({behavior: "auto", block: "center", inline: "center"});
-        e.classList.add("animate__animated");
-        e.classList.add("animate__tada");
+        if (e) {
+            e.scrollIntoView({behavior: "auto", block: "center", inline: "center"});
+            e.classList.add("animate__animated");
+            e.classList.add("animate__tada");
+        }
         localStorage.clear();
     }
+
+    // MORE REVIEWS
+    $('#reviews-more a').on('click', function(){
+        var reviewsMore = $('#reviews-more');
+        $.ajax({
+            type: 'GET',
+            url: reviewsMore.data('url'),
+            dataType: 'json',
+            success: function(rs){
+                $('#review-list').append(rs.html);
+                if (rs.next_url) {
+                    reviewsMore.data('url', rs.next_url);
+                }
+                else {
+                    reviewsMore.remove();
+                }
+            },
+            error: function(rs, e){
+                console.log("Error");
+            },
+        });
+    });
     
-    $('[id^="deleteReview"]').on('click', function(){
+    $(document).on('click', '[id^="deleteReview"]', function(){
         review_id = this.id.split('-')[1];
         var rating = $(this).data('rating');
         var answer = confirm(gettext('Are you sure you want to delete this review?'));
@@ -254,7 +352,7 @@ $(document).ready(function(){
         }
     });
     
-    $('[id^="deleteReply"]').on('click', function(){
+    $(document).on('click', '[id^="deleteReply"]', function(){
         reply_id = this.id.split('-')[1];
         review_id = $(this).attr('name').split('-')[1];
         var answer = confirm(gettext('Are you sure you want to delete this comment?'));
@@ -400,7 +498,6 @@ $(document).ready(function(){
         for(var i=0; i<container.length; i++) {
             changeSubtotalOnLoad(container[i]);
         }
-        total();
     };
 
     // CHANGE SUBTOTAL
@@ -420,30 +517,56 @@ $(document).ready(function(){
         element.nextElementSibling.innerHTML = subtotal;
     }
 
-    // SUM TOTAL
+    // TOTALS: saves the quantities of the cart, then shows its totals computed by the server
+    var totalsTimer = null;
     function total(){
-        var totalDisplay = document.getElementById("total_display");
-        var totalDisplay2 = document.getElementById("total_display2");
-        var endtotalDisplay = document.getElementById("endtotal_display");
-        var totalQuantity = document.getElementById("total_quantity");
-        var delvCharges = document.getElementById("delv_charges");
-
-        var sum = 0;
-        var noitems = 0;
+        var summary = document.getElementById("cart-totals");
         var tbody = document.getElementById("all_foods");
-        if (!tbody) return;
+        if (!summary || !tbody) return;
 
-        for (var i = 0; i < tbody.rows.length; i++) {
-            sum = sum + parseFloat(tbody.rows[i].cells[4].innerHTML);
-            noitems = noitems + parseInt(tbody.rows[i].cells[3].getElementsByTagName('input')[0].value);
-        }
-        
-        var total = sum.toFixed(2);
-        totalDisplay.innerHTML = "$"+total;
-        totalDisplay2.innerHTML = "$"+total;
-        totalQuantity.innerHTML = noitems;
-        endtotalDisplay.innerHTML = delvCharges.innerText ? (parseFloat(total)+parseFloat(delvCharges.innerText)).toFixed(2) : "$"+total;
+        clearTimeout(totalsTimer);
+        totalsTimer = setTimeout(function(){
+            var pdict = {};
+            for (var i = 0; i < tbody.rows.length; i++) {
+                var PID = tbody.rows[i].cells[1].getElementsByClassName('pid')[0].innerText;
+                pdict[PID] = tbody.rows[i].cells[3].getElementsByTagName('input')[0].value;
+            }
+            $.ajax({
+                type: 'POST',
+                url: summary.dataset.url,
+                data: {
+                    'checkoutip': JSON.stringify(pdict),
+                    'csrfmiddlewaretoken': csrftoken
+                },
+                dataType: 'json',
+                success: function(totals){
+                    $("#total_display, #total_display2").html("$" + totals.subtotal);
+                    $("#total_quantity").html(totals.quantity);
+                    $("#delv_charges").html("$" + totals.delivery_charges);
+                    $("#discount_display").html("-$" + totals.discount);
+                    $("#endtotal_display").html("$" + totals.total);
+                },
+            });
+        }, 300);
     }
+
+    // APPLY COUPON
+    $("#coupon-form").on('submit', function(e){
+        e.preventDefault();
+        $.ajax({
+            type: 'POST',
+            url: this.action,
+            data: $(this).serialize(),
+            dataType: 'json',
+            success: function(response){
+                if (response.success == true) {
+                    $("#coupon_display").text(response.code);
+                    total();
+                }
+                else alert(response.message);
+            },
+        });
+    });
     
     $("#checkout").on('click', function(){
         var tbody = $("#all_foods")[0];
@@ -459,7 +582,7 @@ $(document).ready(function(){
         cfs.submit();
     });
     
-    $("[id^='order-cancel']").on('click', function(){
+    $(document).on('click', "[id^='order-cancel']", function(){
         var uuid = this.id.replace("order-cancel-", '');
         if (window.location.href.indexOf('/en-us/') != -1) lang = '/en-us/';
         else lang = '/vi/';
@@ -541,7 +664,8 @@ $(document).ready(function(){
                 rzp1.open();
             },
             error: function(rs, e){
-                console.log("Error");
+                if (rs.responseJSON && rs.responseJSON.error) alert(rs.responseJSON.error);
+                else console.log("Error");
             },
         });
     });
@@ -0,0 +1,14 @@
+from django import template
+from ..utils import fragments
+
+register = template.Library()
+
+@register.simple_tag
+def food_fragments(template_name, foods):
+    '''{% food_fragments "foods/card.html" foods as cards %}: (food, parts) pairs, see `main.utils.fragments`'''
+    return fragments.get_fragments(template_name, foods)
+
+@register.simple_tag
+def food_fragment(template_name, food):
+    '''{% food_fragment "foods/details_header.html" food as header %}: the parts of one food'''
+    return fragments.get_fragments(template_name, [food])[0][1]
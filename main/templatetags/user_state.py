@@ -0,0 +1,13 @@
+from django import template
+
+register = template.Library()
+
+@register.filter
+def in_cart(food, user_state):
+    '''{% if food|in_cart:user_state %}'''
+    return user_state.in_cart(food)
+
+@register.filter
+def in_wishlist(food, user_state):
+    '''{% if food|in_wishlist:user_state %}'''
+    return user_state.in_wishlist(food)
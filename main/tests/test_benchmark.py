@@ -0,0 +1,42 @@
+from django.test import TestCase, override_settings
+from django.db.models import Sum
+import random
+from main.benchmark import data, journey, report
+from main.models import Bill, CaptureJob, Food, Item, User
+
+@override_settings(PAYMENT_GATEWAY='main.utils.payments.FakeGateway')
+class LoadTestTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = data.generate(data.Scale(foods=30, users=3, reviews=40, replies=10, orders=5), random.Random(0))
+
+    def test_generate(self):
+        self.assertEqual(len(self.users), 3)
+        self.assertEqual(Food.objects.filter(description__endswith=data.MARKER).count(), 30)
+        self.assertEqual(Bill.objects.filter(recipient=data.MARKER).count(), 5)
+        # The best sellers follow the generated orders
+        sold = Item.objects.filter(bill__recipient=data.MARKER).aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(Food.objects.aggregate(total=Sum('order_count'))['total'], sold)
+
+    def test_journeys_reach_the_payment(self):
+        rng = random.Random(1)
+        journeys = [journey.customer_journey(random.Random(rng.random()), data.WORDS) for _ in range(3)]
+        recorder = report.Recorder()
+        journey.run_wsgi(self.users, journeys, recorder)
+
+        summary = recorder.summary(1.0)
+        self.assertEqual(summary['aborted_journeys'], {})
+        self.assertEqual(summary['routes']['handle-payment']['count'], 3)
+        self.assertTrue(all(stats['errors'] == 0 for stats in summary['routes'].values()))
+        self.assertEqual(CaptureJob.objects.count(), 3)
+
+    def test_cleanup(self):
+        data.cleanup()
+        self.assertFalse(User.objects.filter(email__endswith=f'@{data.EMAIL_DOMAIN}').exists())
+        self.assertFalse(Food.objects.filter(description__endswith=data.MARKER).exists())
+        self.assertFalse(Bill.objects.filter(recipient=data.MARKER).exists())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([report.percentile(values, p) for p in report.PERCENTILES], [50, 95, 99])
+        self.assertEqual(report.percentile([], 95), 0.0)
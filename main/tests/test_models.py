@@ -1,8 +1,17 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from io import StringIO
 import datetime
+import unittest
 import uuid
-from main.models import User, Notify, Food, Review, Reply, Image, Coupon, Status, Bill, Item
+from main.models import User, Notify, Food, Review, Reply, Image, Coupon, Status, Bill, Item, CaptureJob
+from main.utils.constant import StatusName
+from main.utils.coupons import get_coupon, registry as coupon_registry
+from main.utils.statuses import get_status, registry as status_registry
 
 class UserModelTest(TestCase):
     @classmethod
@@ -96,8 +105,98 @@ class FoodModelTest(TestCase):
     def test_object_name_is_food_name(self):
         test_food = Food.objects.get(id=self.food_id)
         self.assertEqual(str(test_food), test_food.name)
+
+class FoodRatingAggregateTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(email='test@gmail.com', username='testuser', password='1X<ISRUkw+tuK')
+        self.test_food = Food.objects.create(name='test food', price=100.0)
+        Review.objects.create(comment='Good', rating=5, user=self.test_user, food=self.test_food)
+        self.test_review = Review.objects.create(comment='Okay', rating='2', user=self.test_user, food=self.test_food)
+
+    def test_aggregates_are_incremented_on_review_create(self):
+        test_food = Food.objects.get(id=self.test_food.id)
+        self.assertEqual(test_food.rating_count, 2)
+        self.assertEqual(test_food.rating_sum, 7)
+        self.assertEqual(test_food.avg_rating, 3.5)
+        self.assertEqual(test_food.star5_count, 1)
+        self.assertEqual(test_food.star2_count, 1)
+
+    def test_aggregates_are_decremented_on_review_delete(self):
+        self.test_review.delete()
+        test_food = Food.objects.get(id=self.test_food.id)
+        self.assertEqual(test_food.rating_count, 1)
+        self.assertEqual(test_food.avg_rating, 5)
+        self.assertEqual(test_food.star2_count, 0)
+        Review.objects.filter(food=self.test_food).delete()
+        test_food = Food.objects.get(id=self.test_food.id)
+        self.assertEqual(test_food.rating_count, 0)
+        self.assertEqual(test_food.avg_rating, 0)
+
+    def test_aggregates_are_rebuilt_on_user_delete(self):
+        other_user = User.objects.create(email='other@gmail.com', username='otheruser', password='1X<ISRUkw+tuK')
+        Review.objects.create(comment='Bad', rating=1, user=other_user, food=self.test_food)
+        self.test_user.delete()
+        test_food = Food.objects.get(id=self.test_food.id)
+        self.assertEqual(test_food.rating_count, 1)
+        self.assertEqual(test_food.avg_rating, 1)
+        self.assertEqual(test_food.star5_count, 0)
+
+    def test_food_delete_does_not_update_it_per_review(self):
+        def delete_food(reviews):
+            food = Food.objects.create(name=f'food with {reviews} reviews', price=10.0)
+            for i in range(reviews):
+                Review.objects.create(comment='Good', rating=5, user=self.test_user, food=food)
+            with CaptureQueriesContext(connection) as context:
+                food.delete()
+            return len(context.captured_queries)
+        self.assertEqual(delete_food(1), delete_food(10))
+
+    def test_rebuild_command_recomputes_aggregates(self):
+        Food.objects.filter(id=self.test_food.id).update(rating_count=0, rating_sum=0, avg_rating=0, star5_count=0)
+        call_command('rebuild_ratings', stdout=StringIO())
+        test_food = Food.objects.get(id=self.test_food.id)
+        self.assertEqual(test_food.rating_count, 2)
+        self.assertEqual(test_food.avg_rating, 3.5)
+        self.assertEqual(test_food.star5_count, 1)
     
         
+class FoodOrderCountTest(TestCase):
+    def setUp(self):
+        self.test_foods = [Food.objects.create(name=f'food {i}', price=10.0) for i in range(3)]
+        purchased = Status.objects.create(name=StatusName.PURCHASED)
+        processing = Status.objects.create(name=StatusName.PROCESSING)
+        for status, quantity in ((purchased, 2), (purchased, 3), (processing, 4)):
+            bill = Bill.objects.create(recipient='Recipient', phone_number='123456789', address='123 Main Street', status=status)
+            Item.objects.create(bill=bill, food=self.test_foods[0], quantity=quantity, unit_price=10.0)
+            Item.objects.create(bill=bill, food=self.test_foods[1], quantity=1, unit_price=10.0)
+
+    def order_counts(self):
+        return list(Food.objects.filter(id__in=[food.id for food in self.test_foods]).order_by('id').values_list('order_count', flat=True))
+
+    def test_count_orders_in_one_update(self):
+        items = [Item(food=self.test_foods[0], quantity=2), Item(food=self.test_foods[1], quantity=1), Item(food=self.test_foods[0], quantity=1)]
+        with self.assertNumQueries(1):
+            Food.objects.count_orders(items)
+        self.assertEqual(self.order_counts(), [3, 1, 0])
+        Food.objects.count_orders(items, sign=-1)
+        self.assertEqual(self.order_counts(), [0, 0, 0])
+
+    def test_purchased_bill_cancelled_once(self):
+        Food.objects.rebuild_order_counts()
+        bill = Bill.objects.filter(status__name=StatusName.PURCHASED).order_by('total', 'id').first()
+        quantity = bill.item_set.get(food=self.test_foods[0]).quantity
+        # Two concurrent cancels of the same bill, read before either one is saved
+        first, second = Bill.objects.get(id=bill.id), Bill.objects.get(id=bill.id)
+        self.assertTrue(Bill.objects.cancel(first))
+        self.assertFalse(Bill.objects.cancel(second))
+        self.assertEqual(self.order_counts(), [5 - quantity, 1, 0])
+        self.assertEqual(Bill.objects.get(id=bill.id).status.name, StatusName.CANCELLED)
+
+    def test_reconcile_command_recomputes_the_counts(self):
+        Food.objects.filter(id=self.test_foods[2].id).update(order_count=7)
+        call_command('reconcile_order_counts', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.order_counts(), [5, 2, 0])
+
 class ReviewModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -155,6 +254,53 @@ class CouponModelTest(TestCase):
         test_coupon = Coupon.objects.get(id=self.coupon_id)
         self.assertEqual(str(test_coupon), test_coupon.code)
         
+    def test_redeem_counts_the_uses(self):
+        Coupon.objects.filter(id=self.coupon_id).update(max_uses=2)
+        self.assertTrue(Coupon.objects.redeem(self.coupon_id))
+        self.assertTrue(Coupon.objects.redeem(self.coupon_id))
+        self.assertFalse(Coupon.objects.redeem(self.coupon_id))
+        self.assertEqual(Coupon.objects.get(id=self.coupon_id).use_count, 2)
+
+    def test_redeem_unlimited(self):
+        for i in range(3):
+            self.assertTrue(Coupon.objects.redeem(self.coupon_id))
+
+    def test_redeem_expired_or_inactive(self):
+        Coupon.objects.filter(id=self.coupon_id).update(end=timezone.now())
+        self.assertFalse(Coupon.objects.redeem(self.coupon_id))
+        Coupon.objects.filter(id=self.coupon_id).update(end=None, is_active=False)
+        self.assertFalse(Coupon.objects.redeem(self.coupon_id))
+        self.assertEqual(Coupon.objects.get(id=self.coupon_id).use_count, 0)
+
+class CouponRegistryTest(TransactionTestCase):
+    # Committed rows only: the registry does not cache what it reads inside a transaction
+    def setUp(self):
+        coupon_registry.invalidate()
+        now = timezone.now()
+        self.sale = Coupon.objects.create(code='SALE', value=0.9, start=now - datetime.timedelta(days=1))
+        self.later = Coupon.objects.create(code='LATER', value=0.5, start=now + datetime.timedelta(days=1))
+        self.expired = Coupon.objects.create(code='OLD', value=0.5, start=now - datetime.timedelta(days=2), end=now)
+
+    def test_valid_coupons_are_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_coupon(' SALE '), self.sale)
+            self.assertIsNone(get_coupon('LATER'))
+            self.assertIsNone(get_coupon('OLD'))
+            self.assertIsNone(get_coupon('NONE'))
+
+    def test_expires_at_the_next_boundary(self):
+        get_coupon('SALE')
+        self.assertEqual(coupon_registry._expires, self.later.start)
+        coupon_registry._expires = timezone.now()
+        Coupon.objects.filter(id=self.later.id).update(start=timezone.now())
+        self.assertEqual(get_coupon('LATER'), self.later)
+
+    def test_changes_invalidate_the_registry(self):
+        get_coupon('SALE')
+        self.sale.is_active = False
+        self.sale.save()
+        self.assertIsNone(get_coupon('SALE'))
+
 class StatusModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -174,6 +320,37 @@ class StatusModelTest(TestCase):
         test_status = Status.objects.get(id=self.status_id)
         self.assertEqual(str(test_status), test_status.name)
         
+class StatusRegistryTest(TransactionTestCase):
+    # Committed rows only: the registry does not cache what it reads inside a transaction
+    def setUp(self):
+        status_registry.invalidate()
+        Status.objects.create(name=StatusName.CART)
+        Status.objects.create(name=StatusName.PROCESSING)
+
+    def test_statuses_are_loaded_once(self):
+        with self.assertNumQueries(1):
+            get_status(StatusName.CART)
+            processing = get_status(StatusName.PROCESSING)
+        self.assertEqual(processing, Status.objects.get(name='processing'))
+
+    def test_missing_status_is_created(self):
+        cancelled = get_status(StatusName.CANCELLED)
+        self.assertTrue(Status.objects.filter(id=cancelled.id, name='cancelled').exists())
+
+    def test_changes_invalidate_the_registry(self):
+        cart = get_status(StatusName.CART)
+        cart.description = 'Not ordered yet'
+        cart.save()
+        self.assertEqual(get_status(StatusName.CART).description, 'Not ordered yet')
+        cart.delete()
+        self.assertNotEqual(get_status(StatusName.CART).id, cart.id)
+
+    def test_not_cached_inside_transaction(self):
+        with transaction.atomic():
+            get_status(StatusName.CART)
+        with self.assertNumQueries(1):
+            get_status(StatusName.CART)
+
 class BillModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -232,6 +409,31 @@ class BillModelTest(TestCase):
         test_bill = Bill.objects.get(id=self.bill_id)
         self.assertEqual(str(test_bill), str(test_bill.id))
 
+class BillCartTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(email='test@gmail.com', username='testuser', password='1X<ISRUkw+tuK')
+
+    def test_new_user_has_no_cart(self):
+        self.assertFalse(Bill.objects.filter(user=self.test_user).exists())
+
+    def test_get_or_create_cart_returns_the_same_bill(self):
+        cart = Bill.objects.get_or_create_cart(self.test_user)
+        self.assertEqual(cart.cart_owner, self.test_user)
+        self.assertEqual(cart.status.name, 'cart')
+        self.assertEqual(Bill.objects.get_or_create_cart(self.test_user), cart)
+
+    def test_one_cart_per_user(self):
+        status, notExist = Status.objects.get_or_create(name='cart')
+        Bill.objects.create(user=self.test_user, status=status)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Bill.objects.create(user=self.test_user, status=status)
+
+    def test_cart_owner_is_cleared_when_ordered(self):
+        cart = Bill.objects.get_or_create_cart(self.test_user)
+        cart.status = Status.objects.create(name='processing')
+        cart.save()
+        self.assertIsNone(Bill.objects.get(id=cart.id).cart_owner)
+
 class ItemModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -253,3 +455,81 @@ class ItemModelTest(TestCase):
         test_bill = Bill.objects.get(id=self.test_bill_id)
         expected_bill_total = test_item1.unit_price * test_item1.quantity + test_item2.unit_price * test_item2.quantity
         self.assertEqual(test_bill.total, expected_bill_total)
+
+# The plans are read from SQLite's EXPLAIN QUERY PLAN or from the columns of MySQL's EXPLAIN
+@unittest.skipUnless(connection.vendor in ('sqlite', 'mysql'), 'EXPLAIN output')
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create(email='test@gmail.com', username='testuser')
+        cls.bill_id = uuid.uuid4()
+
+    def assertUsesIndex(self, queryset, index=None, scan=False):
+        '''
+        The rows of `queryset` are read through an index (`index` if given), in order: no sort.
+        `scan`: the index is read from its start, e.g. for an ORDER BY ... LIMIT without filter.
+        '''
+        if connection.vendor == 'mysql':
+            self.assertMySQLUsesIndex(queryset, index, scan)
+            return
+        plan = queryset.explain()
+        if not scan:
+            self.assertRegex(plan, r'SEARCH (TABLE )?main_\w+ USING (COVERING )?INDEX')
+            self.assertNotRegex(plan, r'SCAN (TABLE )?main_')
+        # The index gives the rows in order, no sort
+        self.assertNotIn('TEMP B-TREE', plan)
+        if index:
+            self.assertIn(index, plan)
+
+    def assertMySQLUsesIndex(self, queryset, index, scan):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            extra = row['Extra'] or ''
+            # A lookup of a unique key that found no row: MySQL read the index and shows no plan
+            if 'no matching row in const table' in extra or 'noticed after reading const tables' in extra:
+                continue
+            self.assertIsNotNone(row['key'], row)
+            self.assertNotEqual(row['type'], 'ALL', row)
+            if not scan:
+                self.assertNotEqual(row['type'], 'index', row)
+            self.assertNotIn('Using filesort', extra)
+            self.assertNotIn('Using temporary', extra)
+            if index:
+                self.assertEqual(row['key'], index)
+
+    def test_cart(self):
+        self.assertUsesIndex(Bill.objects.filter(cart_owner=self.test_user))
+
+    def test_orders_of_user(self):
+        orders = Bill.objects.filter(user=self.test_user).exclude(status_id=1).order_by('-order_date', '-id')
+        self.assertUsesIndex(orders, 'bill_user_date_idx')
+
+    def test_payment_callback(self):
+        self.assertUsesIndex(Bill.objects.filter(rzp_id='order_test'), 'bill_rzp_id_idx')
+
+    def test_order_token(self):
+        self.assertUsesIndex(Bill.objects.filter(order_token=uuid.uuid4()))
+
+    def test_item_of_bill(self):
+        self.assertUsesIndex(Item.objects.filter(bill_id=self.bill_id, food_id=1))
+
+    def test_reviews_of_food(self):
+        self.assertUsesIndex(Review.objects.filter(food_id=1).order_by('-date_created'), 'review_food_date_idx')
+
+    def test_replies_of_review(self):
+        self.assertUsesIndex(Reply.objects.filter(parent_id=1).order_by('date_created'), 'reply_parent_date_idx')
+
+    def test_best_sellers(self):
+        self.assertUsesIndex(Food.objects.order_by('-order_count', 'id')[:10], 'food_order_count_idx', scan=True)
+
+    def test_coupon_code(self):
+        self.assertUsesIndex(Coupon.objects.filter(code='SALE'))
+
+    def test_capture_queue(self):
+        jobs = CaptureJob.objects.filter(state=CaptureJob.PENDING, run_after__lte=timezone.now()).order_by('run_after', 'id')
+        self.assertUsesIndex(jobs, 'capture_job_queue_idx')
+
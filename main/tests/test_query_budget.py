@@ -0,0 +1,189 @@
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+import collections
+import json
+import random
+import time
+import uuid
+from main import urls
+from main.models import User, Food, Review, Reply, Image, Coupon, Status, Bill, Item
+from main.utils import payments, search
+
+PASSWORD = '1X<ISRUkw+tuK'
+FOODS = 2000
+REVIEWS = 4000
+REPLIES = 2000
+USERS = 50
+ORDERS = 300
+ITEMS_PER_ORDER = 3
+CART_ITEMS = 20
+WISHLIST_FOODS = 20
+REVIEWS_OF_FOOD = 50
+
+Route = collections.namedtuple('Route', 'name method url data max_queries max_seconds')
+Route.__new__.__defaults__ = (None, 1.0)
+
+def seed_dataset(rng):
+    '''
+    Seeds a realistic dataset with bulk inserts (no signals) and rebuilds
+    the derived data: rating aggregates, search tokens.
+    '''
+    statuses = {name: Status.objects.get_or_create(name=name)[0] for name in ('cart', 'processing', 'purchased', 'cancelled')}
+    User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@gmail.com') for i in range(USERS)])
+    users = list(User.objects.order_by('id'))
+    user = users[0]
+    user.set_password(PASSWORD)
+    user.save()
+
+    words = ['pho', 'bo', 'ga', 'com', 'tam', 'bun', 'cha', 'nem', 'chay', 'pizza', 'sushi', 'salad', 'soup', 'rice', 'noodle']
+    Food.objects.bulk_create([
+        Food(
+            name=' '.join(rng.sample(words, 3)) + f' {i}',
+            description=' '.join(rng.choice(words) for _ in range(12)),
+            price=rng.randint(1, 50),
+        )
+        for i in range(FOODS)
+    ])
+    foods = list(Food.objects.order_by('id'))
+    Image.objects.bulk_create([Image(food=food, url=f'/static/img/{food.id}.jpeg') for food in foods])
+
+    # The first food has many reviews, each with replies
+    reviewed = [foods[0]] * REVIEWS_OF_FOOD + [rng.choice(foods) for _ in range(REVIEWS - REVIEWS_OF_FOOD)]
+    Review.objects.bulk_create([
+        Review(comment='Review', rating=rng.randint(1, 5), user=rng.choice(users), food=food) for food in reviewed
+    ])
+    reviews = list(Review.objects.order_by('id'))
+    Reply.objects.bulk_create([
+        Reply(content='Reply', parent=reviews[i % len(reviews)], user=rng.choice(users)) for i in range(REPLIES)
+    ])
+
+    cart = Bill.objects.get_or_create_cart(user)
+    orders = [
+        Bill(
+            user=users[i % 10], recipient='Recipient', phone_number='123456789', address='123 Main Street',
+            status=statuses['purchased' if i % 2 else 'processing'], total=100.0, rzp_id=f'order_{i}',
+        )
+        for i in range(ORDERS)
+    ]
+    Bill.objects.bulk_create(orders)
+    items = [
+        Item(bill=order, food=food, quantity=1, unit_price=food.price)
+        for order in orders for food in rng.sample(foods, ITEMS_PER_ORDER)
+    ]
+    items += [Item(bill=cart, food=food, quantity=1, unit_price=food.price) for food in foods[:CART_ITEMS]]
+    Item.objects.bulk_create(items)
+    user.food_saved.add(*foods[:WISHLIST_FOODS])
+
+    Food.objects.rebuild_rating_aggregates()
+    # TokenIndexBackend too, for test_token_index_search_within_budget
+    search.TokenIndexBackend().rebuild()
+    search.get_backend().rebuild()
+    return user, foods, reviews, orders
+
+@override_settings(PAYMENT_GATEWAY='main.utils.payments.FakeGateway', RAZORPAY_KEY_SECRET='secret')
+class QueryBudgetTest(TestCase):
+    '''
+    Every route of `main.urls` has a budget: a maximum number of queries and seconds
+    on a seeded dataset, so an N+1 in a view or a template fails the suite.
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.foods, cls.reviews, cls.orders = seed_dataset(random.Random(0))
+        Coupon.objects.create(code='SALE', value=0.9, start=timezone.now())
+
+    def routes(self):
+        food = self.foods[0]
+        review = self.reviews[0]
+        order = self.orders[0]
+        reply = Reply.objects.filter(user=self.user).first() or Reply.objects.create(parent=review, user=self.user, content='Reply')
+        own_review = Review.objects.filter(user=self.user).first()
+        checkout = {
+            'fprice': 100.0, 'inputName': 'Recipient', 'inputPhoneNo': '123456789', 'inputAddress': '123 Main Street',
+            'inputCity': 'Hanoi', 'inputCountry': 'Vietnam', 'inputZip': '1111', 'inputShipNote': 'Note',
+            'orderToken': str(uuid.uuid4()),
+        }
+        payment = {
+            'razorpay_order_id': order.rzp_id,
+            'razorpay_payment_id': 'pay_budget',
+            'razorpay_signature': payments.sign(order.rzp_id, 'pay_budget', 'secret'),
+        }
+        return [
+            Route('index', 'get', reverse('index'), None, 6),
+            Route('search', 'get', reverse('search') + '?query=pho bo chay', None, 7),
+            Route('menu-page', 'get', reverse('menu-page'), None, 6),
+            Route('login', 'get', reverse('login'), None, 2),
+            Route('logout', 'get', reverse('logout'), None, 4),
+            Route('register', 'get', reverse('register'), None, 2),
+            Route('password_reset', 'get', reverse('password_reset'), None, 2),
+            Route('password_reset_done', 'get', reverse('password_reset_done'), None, 2),
+            Route('password_reset_confirm', 'get', reverse('password_reset_confirm', args=['MQ', 'token']), None, 3),
+            Route('password_reset_complete', 'get', reverse('password_reset_complete'), None, 2),
+            Route('food-details', 'get', reverse('food-details', args=[food.id]), None, 8),
+            Route('review-page', 'get', reverse('review-page', args=[food.id]) + '?sort=helpful', None, 5),
+            Route('review', 'post', reverse('review', args=[food.id]), {'comment': 'Good', 'rating': 5}, 6),
+            Route('reply', 'post', reverse('reply', args=[food.id, review.id]), {'content': 'Thanks'}, 5),
+            Route('delete-review', 'post', reverse('delete-review', args=[own_review.id]), None, 10),
+            Route('delete-reply', 'post', reverse('delete-reply', args=[reply.id]), None, 4),
+            Route('cart', 'get', reverse('cart'), None, 6),
+            Route('cart-totals', 'post', reverse('cart-totals'), {'checkoutip': json.dumps({food.id: 2 for food in self.foods[:5]})}, 7),
+            Route('add-to-cart', 'post', reverse('add-to-cart'), {'id': self.foods[-1].id}, 8),
+            Route('apply-coupon', 'post', reverse('apply-coupon'), {'code': 'SALE'}, 6),
+            Route('remove-from-cart', 'post', reverse('remove-from-cart', args=[Item.objects.filter(bill__cart_owner=self.user).first().id]), None, 4),
+            Route('profile', 'get', reverse('profile'), None, 7),
+            Route('profile-orders', 'get', reverse('profile-orders'), None, 5),
+            Route('profile-reviews', 'get', reverse('profile-reviews'), None, 3),
+            Route('profile-comments', 'get', reverse('profile-comments'), None, 3),
+            Route('checkout', 'post', reverse('checkout'), {'checkoutip': json.dumps({food.id: 2 for food in self.foods[:5]})}, 7),
+            Route('handle-checkout', 'post', reverse('handle-checkout'), checkout, 9),
+            Route('payment', 'get', reverse('payment', args=[order.id]), None, 3),
+            Route('cancel-order', 'post', reverse('cancel-order'), {'uuid': order.id}, 11),
+            Route('open-payment', 'post', reverse('open-payment'), {'lang': '/en-us/', 'order_id': order.id}, 5),
+            Route('handle-payment', 'post', reverse('handle-payment'), payment, 8),
+            Route('wishlist', 'get', reverse('wishlist'), None, 5),
+            Route('add-to-wishlist', 'post', reverse('add-to-wishlist'), {'food_id': self.foods[-1].id}, 5),
+            Route('remove-from-wishlist', 'delete', reverse('remove-from-wishlist', args=[self.foods[0].id]), None, 4),
+            Route('receipt', 'get', reverse('receipt', args=[order.id]), None, 5),
+        ]
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertEqual(names - {route.name for route in self.routes()}, set())
+
+    def test_routes_within_budget(self):
+        for route in self.routes():
+            with self.subTest(route=route.name):
+                queries, seconds, status_code = self.measure(route)
+                self.assertLess(status_code, 500)
+                self.assertLessEqual(
+                    len(queries), route.max_queries,
+                    '\n'.join([f'{route.name}: {len(queries)} queries'] + [query['sql'] for query in queries]),
+                )
+                self.assertLessEqual(seconds, route.max_seconds)
+
+    @override_settings(SEARCH_BACKEND='main.utils.search.TokenIndexBackend')
+    def test_token_index_search_within_budget(self):
+        # 2 queries per search word of 3 characters or more, 1 to rank the foods
+        route = Route('search', 'get', reverse('search') + '?query=pho chay rice', None, 13)
+        queries, seconds, status_code = self.measure(route)
+        self.assertEqual(status_code, 200)
+        self.assertLessEqual(len(queries), route.max_queries, '\n'.join(query['sql'] for query in queries))
+        self.assertLessEqual(seconds, route.max_seconds)
+
+    def measure(self, route):
+        # Each route runs in a transaction rolled back afterwards: the next one sees the same data
+        self.client.login(email=self.user.email, password=PASSWORD)
+        try:
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = getattr(self.client, route.method)(route.url, data=route.data)
+                    seconds = time.perf_counter() - start
+                raise _Rollback(list(queries), seconds, response.status_code)
+        except _Rollback as result:
+            return result.args
+
+class _Rollback(Exception):
+    pass
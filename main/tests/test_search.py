@@ -0,0 +1,99 @@
+from django.test import TestCase, override_settings
+from main.models import Food, SearchToken, SearchTrigram
+from main.utils.search import DatabaseSearchBackend, InvertedIndexBackend, TokenIndexBackend, fold
+
+@override_settings(SEARCH_BACKEND='main.utils.search.DatabaseSearchBackend')
+class SearchBackendTest(TestCase):
+    def setUp(self):
+        self.pizza = Food.objects.create(name='Pizza', description='Cheese and tomato', price=50.0)
+        self.calzone = Food.objects.create(name='Calzone', description='Folded pizza with cheese', price=60.0)
+        self.sushi = Food.objects.create(name='Sushi', description='Rice and fish', price=100.0)
+
+    def test_database_backend_ranks_name_matches_first(self):
+        backend = DatabaseSearchBackend()
+        self.assertEqual(backend.search('pizza'), [self.pizza.id, self.calzone.id])
+        self.assertEqual(backend.search('sus'), [self.sushi.id])
+        self.assertEqual(backend.search('   '), [])
+
+    def test_database_backend_follows_food_changes(self):
+        backend = DatabaseSearchBackend()
+        self.sushi.name = 'Sashimi'
+        self.sushi.save()
+        self.assertEqual(backend.search('sushi'), [])
+        self.assertEqual(backend.search('sashimi'), [self.sushi.id])
+        self.pizza.delete()
+        self.assertEqual(backend.search('pizza'), [self.calzone.id])
+
+    def test_database_backend_finds_short_terms(self):
+        # Shorter than MySQL's default innodb_ft_min_token_size
+        backend = DatabaseSearchBackend()
+        pho = Food.objects.create(name='Phở Bò', description='Beef noodle soup', price=40.0)
+        com = Food.objects.create(name='Cơm gà', description='Chicken rice', price=30.0)
+        self.assertEqual(backend.search('bò'), [pho.id])
+        self.assertEqual(backend.search('gà'), [com.id])
+        self.assertEqual(set(backend.search('gà sushi')), {com.id, self.sushi.id})
+
+    def test_inverted_index_backend_ranks_name_matches_first(self):
+        backend = InvertedIndexBackend()
+        self.assertEqual(backend.search('pizza'), [self.pizza.id, self.calzone.id])
+        # "fish" is rarer than "cheese", so it weighs more
+        self.assertEqual(backend.search('cheese fish'), [self.sushi.id, self.pizza.id, self.calzone.id])
+        self.assertEqual(backend.search('sus', limit=1), [self.sushi.id])
+
+    def test_inverted_index_backend_follows_food_changes(self):
+        backend = InvertedIndexBackend()
+        backend.search('pizza')
+        backend.index_food(Food.objects.create(name='Pizza Margherita', price=70.0))
+        self.assertEqual(len(backend.search('pizza')), 3)
+
+@override_settings(SEARCH_BACKEND='main.utils.search.TokenIndexBackend')
+class TokenIndexBackendTest(TestCase):
+    def setUp(self):
+        self.pho = Food.objects.create(name='Phở bò', description='Vietnamese beef noodle soup', price=50.0)
+        self.tofu = Food.objects.create(name='Đậu hũ chiên', description='Fried tofu', price=30.0)
+        self.pizza = Food.objects.create(name='Pizza', description='Cheese and tomato', price=60.0)
+
+    def test_fold_strips_vietnamese_diacritics(self):
+        self.assertEqual(fold('Phở Bò'), 'pho bo')
+        self.assertEqual(fold('Đậu hũ'), 'dau hu')
+
+    def test_tokens_are_maintained_on_save_and_delete(self):
+        self.assertEqual(set(SearchToken.objects.filter(food=self.pho).values_list('token', flat=True)), {'pho', 'bo', 'vietnamese', 'beef', 'noodle', 'soup'})
+        self.assertTrue(SearchTrigram.objects.filter(trigram='pho', token='pho').exists())
+        self.pizza.name = 'Calzone'
+        self.pizza.save()
+        self.assertFalse(SearchToken.objects.filter(food=self.pizza, token='pizza').exists())
+        self.pizza.delete()
+        self.assertFalse(SearchToken.objects.filter(token='calzone').exists())
+
+    def test_tables_only_maintained_for_the_token_backend(self):
+        with override_settings(SEARCH_BACKEND='main.utils.search.DatabaseSearchBackend'):
+            sushi = Food.objects.create(name='Sushi', price=100.0)
+        self.assertFalse(SearchToken.objects.filter(food=sushi).exists())
+        self.assertFalse(SearchTrigram.objects.filter(token='sushi').exists())
+        TokenIndexBackend().rebuild()
+        self.assertEqual(TokenIndexBackend().search('sushi'), [sushi.id])
+
+    def test_unused_trigrams_are_removed(self):
+        Food.objects.create(name='Pizza Margherita', price=70.0)
+        self.pizza.name = 'Calzone'
+        self.pizza.save()
+        # Still used by the other pizza
+        self.assertTrue(SearchTrigram.objects.filter(token='pizza').exists())
+        self.assertTrue(SearchTrigram.objects.filter(token='calzone').exists())
+        self.pizza.delete()
+        self.assertFalse(SearchTrigram.objects.filter(token='calzone').exists())
+        self.assertFalse(SearchTrigram.objects.filter(token='tomato').exists())
+        self.assertTrue(SearchTrigram.objects.filter(token='pizza').exists())
+
+    def test_search_is_accent_insensitive(self):
+        backend = TokenIndexBackend()
+        self.assertEqual(backend.search('pho'), [self.pho.id])
+        self.assertEqual(backend.search('phở'), [self.pho.id])
+        self.assertEqual(backend.search('dau hu'), [self.tofu.id])
+
+    def test_search_tolerates_typos_and_prefixes(self):
+        backend = TokenIndexBackend()
+        self.assertEqual(backend.search('piza'), [self.pizza.id])
+        self.assertEqual(backend.search('noodl'), [self.pho.id])
+        self.assertEqual(backend.search('xyz'), [])
@@ -1,12 +1,22 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
+from django.core.management import call_command
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.auth.models import Permission
+from asgiref.sync import async_to_sync
+from io import StringIO
+import threading
+import time
 import uuid
 import datetime
 import json
-from main.models import User, Notify, Food, Review, Reply, Image, Coupon, Status, Bill, Item
+from main.models import User, Notify, Food, Review, Reply, Image, Coupon, Status, Bill, Item, CaptureJob
+from main.utils import fragments, page_cache, pagination, payments, timing
+from django.test import Client
+import re
 
 class IndexViewTest(TestCase):
     def setUp(self):
@@ -31,6 +41,67 @@ class IndexViewTest(TestCase):
         self.assertTrue('foods' in response.context)
         self.assertEqual(len(response.context['foods']), 2)
 
+    @override_settings(MENU_PAGE_SIZE=2)
+    def test_menu_is_paginated_by_rating_then_id(self):
+        foods = list(Food.objects.order_by('id'))
+        Food.objects.filter(id=foods[2].id).update(avg_rating=4.0)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(list(response.context['foods']), [foods[2], foods[0]])
+        next_page = response.context['next_page']
+        self.assertTrue(next_page)
+
+        response = self.client.get(f"{reverse('menu-page')}?{next_page}")
+        content = response.json()
+        self.assertEqual(content['count'], 1)
+        self.assertIsNone(content['next_url'])
+        self.assertIn('Sushi', content['html'])
+
+    @override_settings(MENU_PAGE_SIZE=2)
+    def test_menu_best_sellers(self):
+        foods = list(Food.objects.order_by('id'))
+        Food.objects.filter(id=foods[1].id).update(order_count=5)
+        Food.objects.filter(id=foods[2].id).update(order_count=3, avg_rating=4.0)
+        response = self.client.get(reverse('index'), data={'sort': 'best-sellers'})
+        self.assertEqual(response.context['sort'], 'best-sellers')
+        self.assertEqual(list(response.context['foods']), [foods[1], foods[2]])
+
+        response = self.client.get(f"{reverse('menu-page')}?{response.context['next_page']}")
+        self.assertEqual(response.json()['count'], 1)
+        self.assertIn('Pizza', response.json()['html'])
+
+    @override_settings(MENU_PAGE_SIZE=1)
+    def test_search_is_paginated(self):
+        response = self.client.get(reverse('search'), data={'query': 'sushi pizza'})
+        self.assertEqual(len(response.context['foods']), 1)
+        self.assertEqual(response.context['result_count'], 2)
+        response = self.client.get(f"{reverse('menu-page')}?{response.context['next_page']}")
+        self.assertEqual(response.json()['count'], 1)
+        self.assertIsNone(response.json()['next_url'])
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_capped_search_says_so(self):
+        response = self.client.get(reverse('search'), data={'query': 'sushi pizza'})
+        self.assertEqual(response.context['result_count'], 1)
+        self.assertTrue(response.context['result_capped'])
+        self.assertContains(response, 'only the most relevant are shown')
+        response = self.client.get(reverse('search'), data={'query': 'sushi'})
+        self.assertFalse(response.context['result_capped'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('menu-page'), data={'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        # Decoded, but not the values of the ordering: a list, a string id, a dict, a date
+        for values in ([[4.5], 1], [4.5, 'abc'], {'id': 1}, [4.5, {'id': 1}], [4.5, None], ['2021-01-01', 1]):
+            cursor = pagination.encode_cursor(values)
+            for data in ({'cursor': cursor}, {'cursor': cursor, 'query': 'pizza'}):
+                self.assertEqual(self.client.get(reverse('menu-page'), data=data).status_code, 400, (values, data))
+        self.assertEqual(self.client.get(reverse('menu-page'), data={'cursor': '%%%'}).status_code, 400)
+
+    def test_view_search_food_description_ranked_by_relevance(self):
+        Food.objects.create(name='Calzone', description='Folded pizza', price=60.0)
+        response = self.client.get(reverse('search'), data={'query': 'pizza'})
+        self.assertEqual([food.name for food in response.context['foods']], ['Pizza', 'Calzone'])
+
 class FoodDetailViewTest(TestCase):
     def setUp(self):
         self.test_food = Food.objects.create(name='Test food name', description='Test food description', price=100.0)
@@ -48,6 +119,244 @@ class FoodDetailViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'foods/details.html')
 
+    def test_rating_breakdown_per_star(self):
+        test_user = User.objects.create(username='test', email='test@gmail.com')
+        for rating in [5, 5, 4, 1]:
+            Review.objects.create(rating=rating, comment='Test comment', user=test_user, food=self.test_food)
+        response = self.client.get(reverse('food-details', kwargs={'id': self.test_food.pk}))
+        rate_dict = response.context['rate_dict']
+        self.assertEqual(rate_dict[5], ['success', 2, 50])
+        self.assertEqual(rate_dict[4], ['primary', 1, 25])
+        self.assertEqual(rate_dict[3], ['info', 0, 0])
+        self.assertEqual(rate_dict[1], ['danger', 1, 25])
+
+class UserStateTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+        self.test_food1 = Food.objects.create(name='Pizza', price=50.0)
+        self.test_food2 = Food.objects.create(name='Sushi', price=100.0)
+        test_status, notExist = Status.objects.get_or_create(name='cart')
+        test_bill, notExist = Bill.objects.get_or_create(user=self.test_user, status=test_status)
+        Item.objects.create(food=self.test_food1, bill=test_bill, quantity=1, unit_price=50.0)
+        self.test_user.food_saved.add(self.test_food2)
+
+    def test_user_state_loads_cart_and_wishlist_ids_once(self):
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('index'))
+        user_state = response.context['user_state']
+        with self.assertNumQueries(0):
+            self.assertEqual(user_state.cart_food_ids, {self.test_food1.id})
+            self.assertEqual(user_state.wishlist_food_ids, {self.test_food2.id})
+        self.assertContains(response, f'id="like-{self.test_food2.id}-menu" type="submit" name="menu-view" value="{self.test_food2.id}" ><i class="fas fa-heart')
+        self.assertContains(response, f'value="{self.test_food1.id}" ><i class="fas fa-check-circle">')
+
+    def test_user_state_is_empty_for_anonymous_user(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['user_state'].cart_food_ids, frozenset())
+
+@override_settings(REVIEW_PAGE_SIZE=3)
+class ReviewPageTest(TestCase):
+    def setUp(self):
+        page_cache.get_cache().clear()
+        self.test_food = Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        now = timezone.now()
+        # Two reviews per timestamp: the id breaks the ties
+        self.reviews = [
+            Review.objects.create(rating=5, comment=f'Review {i}', user=self.test_user, food=self.test_food,
+                                  date_created=now - datetime.timedelta(microseconds=i // 2))
+            for i in range(8)
+        ]
+        for review in self.reviews[5:7]:
+            Reply.objects.create(parent=review, user=self.test_user, content='Reply')
+        Reply.objects.create(parent=self.reviews[6], user=self.test_user, content='Reply')
+
+    def collect(self, sort):
+        response = self.client.get(reverse('food-details', args=[self.test_food.id]), data={'sort': sort})
+        ids = [review.id for review in response.context['reviews']]
+        url = response.context['next_reviews_url']
+        while url:
+            page = json.loads(self.client.get(url).content)
+            ids += [int(i) for i in re.findall(r'id="comment(\d+)"', page['html'])]
+            url = page['next_url']
+        return ids
+
+    def test_details_page_bounded(self):
+        response = self.client.get(reverse('food-details', args=[self.test_food.id]))
+        self.assertEqual(len(response.context['reviews']), 3)
+        self.assertContains(response, 'id="reviews-more"')
+        self.assertContains(response, '<span class="badge">8</span>')
+
+    def test_newest_first(self):
+        newest = sorted(self.reviews, key=lambda review: (review.date_created, review.id), reverse=True)
+        self.assertEqual(self.collect('newest'), [review.id for review in newest])
+
+    def test_most_helpful_first(self):
+        ids = self.collect('helpful')
+        self.assertEqual(ids[:2], [self.reviews[6].id, self.reviews[5].id])
+        self.assertEqual(sorted(ids), sorted(review.id for review in self.reviews))
+
+    def test_replies_and_users_prefetched(self):
+        url = reverse('review-page', args=[self.test_food.id])
+        # Food, reviews with their author, replies with their author
+        with self.assertNumQueries(3):
+            response = self.client.get(url, data={'sort': 'helpful'})
+        self.assertEqual(json.loads(response.content)['count'], 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('review-page', args=[self.test_food.id]), data={'cursor': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.test_food = Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        Image.objects.create(food=self.test_food, url='/static/img/pizza.jpeg')
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+
+    def test_cards_cached_between_requests(self):
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, '/static/img/pizza.jpeg')
+        self.assertFalse([query for query in queries if 'main_image' in query['sql']])
+
+    def test_card_invalidated_by_food_image_and_review(self):
+        self.client.get(reverse('index'))
+        self.test_food.name = 'Margherita'
+        self.test_food.save()
+        self.assertContains(self.client.get(reverse('index')), 'Margherita')
+
+        Image.objects.create(food=self.test_food, url='/static/img/margherita.jpeg')
+        self.assertContains(self.client.get(reverse('food-details', args=[self.test_food.id])), 'margherita.jpeg')
+
+        self.assertNotContains(self.client.get(reverse('index')), 'fas fa-star f-star')
+        Review.objects.create(rating=5, comment='Good', user=self.test_user, food=self.test_food)
+        self.assertContains(self.client.get(reverse('index')), 'fas fa-star f-star', count=5)
+
+    def test_user_toggles_not_cached(self):
+        self.assertContains(self.client.get(reverse('index')), 'fa-cart-plus')
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.client.post(reverse('add-to-cart'), data={'id': self.test_food.id})
+        self.test_user.food_saved.add(self.test_food)
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'fa-check-circle')
+        self.assertContains(response, 'fas fa-heart nf-heart')
+        response = self.client.get(reverse('food-details', args=[self.test_food.id]))
+        self.assertContains(response, 'REMOVE FROM CART')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+        self.client.logout()
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'fa-check-circle')
+        self.assertNotContains(response, 'nf-heart')
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        page_cache.get_cache().clear()
+        fragments.get_cache().clear()
+        self.test_food = Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+
+    def csrf_field(self, response):
+        return re.search(r'name="csrfmiddlewaretoken" value="([^"]*)"', response.content.decode()).group(1)
+
+    def test_anonymous_pages_served_from_cache(self):
+        for url in [reverse('index'), reverse('food-details', args=[self.test_food.id])]:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertContains(response, 'Pizza')
+            self.assertIsNone(response.context)
+
+    def test_csrf_token_of_each_visitor(self):
+        url = reverse('food-details', args=[self.test_food.id])
+        self.client.get(url)
+        visitor = Client(enforce_csrf_checks=True)
+        response = visitor.get(url)
+        self.assertIsNone(response.context)
+        token = self.csrf_field(response)
+        self.assertTrue(token)
+        self.assertIn('csrftoken', response.cookies)
+        # The token of the cached page is accepted with the cookie of this visitor
+        response = visitor.post(reverse('set_language'), data={'language': 'vi', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_etag_not_modified(self):
+        response = self.client.get(reverse('index'))
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.test_food.name = 'Margherita'
+        self.test_food.save()
+        response = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Margherita')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_keyed_by_language_and_query_string(self):
+        self.client.get(reverse('index'))
+        # No signal: the cached menu is not invalidated
+        Food.objects.bulk_create([Food(name='Margherita', description='Test food description', price=50.0)])
+        self.assertNotContains(self.client.get(reverse('index')), 'Margherita')
+        self.assertContains(self.client.get(reverse('index') + '?cursor='), 'Margherita')
+        self.assertContains(self.client.get('/vi/'), 'Margherita')
+
+    def test_targeted_invalidation(self):
+        other = Food.objects.create(name='Sushi', description='Test food description', price=50.0)
+        review = Review.objects.create(rating=5, comment='Good', user=self.test_user, food=self.test_food)
+        details = reverse('food-details', args=[self.test_food.id])
+        other_details = reverse('food-details', args=[other.id])
+        for url in [reverse('index'), details, other_details]:
+            self.client.get(url)
+
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.client.post(reverse('reply', args=[self.test_food.id, review.id]), data={'content': 'Thanks a lot'})
+        self.client.logout()
+        self.assertContains(self.client.get(details), 'Thanks a lot')
+        self.assertIsNone(self.client.get(other_details).context)
+        self.assertIsNone(self.client.get(reverse('index')).context)
+
+        Image.objects.create(food=self.test_food, url='/static/img/pizza.jpeg')
+        self.assertContains(self.client.get(reverse('index')), 'pizza.jpeg')
+        self.assertIsNone(self.client.get(other_details).context)
+
+    def test_replies_outside_the_views(self):
+        # As the admin does: the model, not the reply views
+        review = Review.objects.create(rating=5, comment='Good', user=self.test_user, food=self.test_food)
+        details = reverse('food-details', args=[self.test_food.id])
+        self.client.get(details)
+        reply = Reply.objects.create(content='Thanks a lot', parent=review, user=self.test_user)
+        self.assertContains(self.client.get(details), 'Thanks a lot')
+
+        reply.content = 'Thank you'
+        reply.save()
+        self.assertContains(self.client.get(details), 'Thank you')
+
+        reply.delete()
+        self.assertNotContains(self.client.get(details), 'Thank you')
+
+        Reply.objects.create(content='See you soon', parent=review, user=self.test_user)
+        self.assertContains(self.client.get(details), 'See you soon')
+        Reply.objects.filter(parent=review).delete()
+        self.assertNotContains(self.client.get(details), 'See you soon')
+
+    def test_bypassed_when_logged_in_or_messages(self):
+        self.client.get(reverse('index'))
+        self.client.post(reverse('register'), data={
+            'username': 'new', 'email': 'new@gmail.com', 'password1': '1X<ISRUkw+tuK', 'password2': '1X<ISRUkw+tuK',
+        })
+        self.assertContains(self.client.get(reverse('index')), 'Your account has been created')
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('index'))
+        self.assertIsNotNone(response.context)
+        self.assertFalse(response.has_header('ETag'))
+
 class RegisterViewTest(TestCase):
     def test_view_url_exists_at_desired_location(self):
         response = self.client.get('/en-us/register/')
@@ -121,6 +430,9 @@ class DeleteReviewViewTest(TestCase):
         login = self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
         response = self.client.delete(reverse('delete-review', kwargs={'id': self.test_review.pk}))
         self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual(content['new_average'], 0)
+        self.assertEqual(content['rate_dict']['5'], ['success', 0, 0])
 
 class DeleteReplyViewTest(TestCase):
     def setUp(self):
@@ -170,6 +482,22 @@ class CartViewTest(TestCase):
         self.assertEqual(response.context['cart'].id, self.test_bill.id)
         self.assertTemplateUsed(response, 'cart/cart.html')
 
+    def test_cart_query_count_does_not_grow_with_items(self):
+        login = self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        for i in range(2):
+            food = Food.objects.create(name=f'Test food {i}', price=10.0)
+            Image.objects.create(food=food, url=f'/static/img/{i}.jpeg')
+            Item.objects.create(food=food, bill=self.test_bill, quantity=1, unit_price=food.price)
+        with CaptureQueriesContext(connection) as two_items:
+            self.client.get(reverse('cart'))
+        for i in range(2, 6):
+            food = Food.objects.create(name=f'Test food {i}', price=10.0)
+            Item.objects.create(food=food, bill=self.test_bill, quantity=1, unit_price=food.price)
+        with CaptureQueriesContext(connection) as six_items:
+            response = self.client.get(reverse('cart'))
+        self.assertEqual(len(response.context['items']), 6)
+        self.assertEqual(len(two_items), len(six_items))
+
 class AddToCartViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='test', email='test@gmail.com')
@@ -188,6 +516,24 @@ class AddToCartViewTest(TestCase):
         response = self.client.post(reverse('add-to-cart'), data={'id': self.test_food.id})
         self.assertEqual(response.status_code, 200)
 
+    def test_cart_is_created_on_first_add(self):
+        User.objects.bulk_create([User(username='bulk', email='bulk@gmail.com')])
+        user = User.objects.get(email='bulk@gmail.com')
+        user.set_password('1X<ISRUkw+tuK')
+        user.save()
+        self.assertFalse(Bill.objects.filter(user=user).exists())
+
+        self.client.login(email=user.email, password='1X<ISRUkw+tuK')
+        response = self.client.post(reverse('add-to-cart'), data={'id': self.test_food.id})
+        self.assertEqual(response.json()['action'], 'add')
+        cart = Bill.objects.get(cart_owner=user)
+        self.assertEqual(cart.status.name, 'cart')
+        self.assertEqual(list(cart.item_set.values_list('food_id', flat=True)), [self.test_food.id])
+        # Removing reuses the same cart
+        response = self.client.post(reverse('add-to-cart'), data={'id': self.test_food.id})
+        self.assertEqual(response.json()['action'], 'remove')
+        self.assertEqual(Bill.objects.filter(user=user).count(), 1)
+
 class RemoveFromCartViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='test', email='test@gmail.com')
@@ -233,6 +579,44 @@ class ProfileViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'accounts/profile.html')
 
+    @override_settings(PROFILE_PAGE_SIZE=2)
+    def test_sections_paginated_with_constant_queries(self):
+        food = Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        processing, _ = Status.objects.get_or_create(name='processing')
+        for i in range(5):
+            order = Bill.objects.create(user=self.test_user, status=processing, total=i)
+            Item.objects.create(bill=order, food=food, quantity=i + 1, unit_price=50.0)
+            review = Review.objects.create(rating=4, comment=f'Review {i}', user=self.test_user, food=food)
+            Reply.objects.create(parent=review, user=self.test_user, content=f'Reply {i}')
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['order_count'], 5)
+        self.assertEqual(response.context['review_count'], 5)
+        self.assertEqual(response.context['comment_count'], 5)
+
+        # Session and user, then one query per relation of the prefetch plan
+        # (and the cart status: not cached inside the transaction of the test)
+        expected = {'profile-orders': 5, 'profile-reviews': 3, 'profile-comments': 3}
+        for name, queries in expected.items():
+            url, count = reverse(name), 0
+            while url:
+                with self.assertNumQueries(queries):
+                    page = json.loads(self.client.get(url).content)
+                self.assertContains(self.client.get(url), 'Pizza')
+                count += page['count']
+                url = page['next_url']
+            self.assertEqual(count, 5)
+
+    def test_sections_only_show_own_objects(self):
+        other = User.objects.create(username='other', email='other@gmail.com')
+        food = Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        Review.objects.create(rating=4, comment='Not mine', user=other, food=food)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        page = json.loads(self.client.get(reverse('profile-reviews')).content)
+        self.assertEqual(page['count'], 0)
+        self.assertIsNone(page['next_url'])
+
 class CheckoutCartViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='test', email='test@gmail.com')
@@ -255,6 +639,64 @@ class CheckoutCartViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'cart/checkout.html')
 
+    def checkout(self, checkoutip):
+        return self.client.post(reverse('checkout'), data={'checkoutip': json.dumps(checkoutip)})
+
+    def test_checkout_updates_quantities_and_total(self):
+        test_food2 = Food.objects.create(name='Test food 2', price=50.0)
+        test_item2 = Item.objects.create(food=test_food2, bill=self.test_bill, quantity=1, unit_price=test_food2.price)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.checkout({self.test_food.id: 2, test_food2.id: 3})
+        self.assertEqual(response.context['totals'].total, 350)
+        self.assertEqual(Item.objects.get(id=self.test_item.id).quantity, 2)
+        self.assertEqual(Item.objects.get(id=test_item2.id).quantity, 3)
+
+    def test_checkout_query_count_does_not_depend_on_cart_size(self):
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        with CaptureQueriesContext(connection) as one_item:
+            self.checkout(self.checkoutip)
+        checkoutip = dict(self.checkoutip)
+        for i in range(20):
+            food = Food.objects.create(name=f'Food {i}', price=10.0)
+            Item.objects.create(food=food, bill=self.test_bill, quantity=1, unit_price=food.price)
+            checkoutip[food.id] = 2
+        with CaptureQueriesContext(connection) as many_items:
+            response = self.checkout(checkoutip)
+        self.assertEqual(response.context['totals'].total, 100 + 20 * 2 * 10)
+        self.assertEqual(len(many_items), len(one_item))
+
+    def test_checkout_rejects_invalid_quantities(self):
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.assertEqual(self.checkout({self.test_food.id: 0}).status_code, 400)
+        self.assertEqual(self.checkout({self.test_food.id: 'two'}).status_code, 400)
+        self.assertEqual(Item.objects.get(id=self.test_item.id).quantity, 1)
+
+    def test_checkout_food_not_in_cart(self):
+        test_food2 = Food.objects.create(name='Test food 2', price=50.0)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.checkout({self.test_food.id: 2, test_food2.id: 1})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Item.objects.get(id=self.test_item.id).quantity, 1)
+
+    def test_cart_totals(self):
+        test_food2 = Food.objects.create(name='Test food 2', price=50.0)
+        Item.objects.create(food=test_food2, bill=self.test_bill, quantity=1, unit_price=12.5)
+        coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now())
+        Bill.objects.filter(id=self.test_bill.id).update(coupon=coupon, delivery_charges=3)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('cart-totals'))
+        self.assertEqual(response.json(), {
+            'quantity': 2, 'subtotal': '112.50', 'discount': '56.25', 'delivery_charges': '3.00', 'total': '59.25',
+        })
+        response = self.client.post(reverse('cart-totals'), data={'checkoutip': json.dumps({test_food2.id: 4})})
+        self.assertEqual(response.json()['subtotal'], '150.00')
+        self.assertEqual(Item.objects.get(bill=self.test_bill, food=test_food2).quantity, 4)
+
+    def test_cart_totals_without_cart(self):
+        self.test_bill.delete()
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.assertEqual(self.client.get(reverse('cart-totals')).status_code, 404)
+
 class HandleCheckoutViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='test', email='test@gmail.com')
@@ -292,6 +734,276 @@ class HandleCheckoutViewTest(TestCase):
         })
         self.assertEqual(response.status_code, 200)
 
+    def place_order(self, order_token):
+        return self.client.post(reverse('handle-checkout'), data={
+            'fprice': 100.0,
+            'inputName': 'Repicient',
+            'inputPhoneNo': '123456789',
+            'inputAddress': '123 Main Street',
+            'inputCity': 'Hanoi',
+            'inputCountry': 'Vietnam',
+            'inputZip': '1111',
+            'inputShipNote': 'Test bill shipping note',
+            'orderToken': order_token,
+        })
+
+    def test_cart_is_converted_in_place(self):
+        test_item = Item.objects.create(food=self.test_food, bill=self.test_bill, quantity=1, unit_price=100.0)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.place_order(str(uuid.uuid4()))
+        order = Bill.objects.get(id=self.test_bill.id)
+        self.assertEqual(response.context['order'].id, order.id)
+        self.assertEqual(order.status.name, 'processing')
+        self.assertEqual(order.recipient, 'Repicient')
+        self.assertIsNone(order.cart_owner)
+        self.assertEqual(Item.objects.get(id=test_item.id).bill_id, order.id)
+
+    def test_same_token_places_one_order(self):
+        order_token = str(uuid.uuid4())
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        first = self.place_order(order_token)
+        # The next cart, created by an add to cart, is not converted by a retry
+        Bill.objects.get_or_create_cart(self.test_user)
+        # Session, user, cart and the order found by its token: nothing is written
+        with self.assertNumQueries(4):
+            second = self.place_order(order_token)
+        self.assertEqual(first.context['order'].id, second.context['order'].id)
+        self.assertEqual(Bill.objects.filter(user=self.test_user, status__name='processing').count(), 1)
+        self.assertTrue(Bill.objects.filter(cart_owner=self.test_user).exists())
+
+    def test_invalid_token(self):
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.assertEqual(self.place_order('not-a-token').status_code, 400)
+
+    def test_total_is_computed_from_the_items(self):
+        Item.objects.create(food=self.test_food, bill=self.test_bill, quantity=3, unit_price=100.0)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        # The posted fprice (100.0) is ignored
+        self.place_order(str(uuid.uuid4()))
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).total, 300.0)
+
+    def test_order_redeems_the_coupon(self):
+        coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now(), max_uses=1)
+        Bill.objects.filter(id=self.test_bill.id).update(coupon=coupon)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.assertEqual(self.place_order(str(uuid.uuid4())).status_code, 200)
+        self.assertEqual(Coupon.objects.get(id=coupon.id).use_count, 1)
+
+    def test_cancelled_order_gives_back_the_coupon(self):
+        coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now(), max_uses=1)
+        Bill.objects.filter(id=self.test_bill.id).update(coupon=coupon)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.place_order(str(uuid.uuid4()))
+        # Given back once, however many times the order is cancelled
+        for i in range(2):
+            self.client.post(reverse('cancel-order'), data={'uuid': self.test_bill.id})
+            self.assertEqual(Coupon.objects.get(id=coupon.id).use_count, 0)
+
+    def test_coupon_without_uses_left(self):
+        coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now(), max_uses=1)
+        Coupon.objects.filter(id=coupon.id).update(use_count=1)
+        Bill.objects.filter(id=self.test_bill.id).update(coupon=coupon)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.place_order(str(uuid.uuid4()))
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        # The order is not placed, and the coupon is removed from the cart
+        cart = Bill.objects.get(id=self.test_bill.id)
+        self.assertEqual(cart.cart_owner_id, self.test_user.id)
+        self.assertIsNone(cart.coupon_id)
+
+class ApplyCouponViewTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+        self.test_bill = Bill.objects.get_or_create_cart(self.test_user)
+        self.test_coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now())
+
+    def apply(self, code):
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        return self.client.post(reverse('apply-coupon'), data={'code': code}).json()
+
+    def test_apply_and_remove(self):
+        self.assertEqual(self.apply('HALF'), {'success': True, 'code': 'HALF', 'value': 0.5})
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).coupon_id, self.test_coupon.id)
+        self.assertEqual(self.apply(''), {'success': True, 'code': '', 'value': None})
+        self.assertIsNone(Bill.objects.get(id=self.test_bill.id).coupon_id)
+
+    def test_invalid_coupon(self):
+        Coupon.objects.create(code='SOON', value=0.5, start=timezone.now() + datetime.timedelta(days=1))
+        Coupon.objects.create(code='USED', value=0.5, start=timezone.now(), max_uses=1)
+        Coupon.objects.filter(code='USED').update(use_count=1)
+        for code in ('NONE', 'SOON', 'USED'):
+            self.assertFalse(self.apply(code)['success'])
+        self.assertIsNone(Bill.objects.get(id=self.test_bill.id).coupon_id)
+
+@override_settings(PAYMENT_GATEWAY='main.utils.payments.FakeGateway')
+class PaymentViewTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+        self.test_status, notExist = Status.objects.get_or_create(name='processing')
+        self.test_bill = Bill.objects.create(
+            user=self.test_user, recipient='Recipient', phone_number='123456789',
+            address='123 Main Street', total=100.0, status=self.test_status,
+        )
+        self.gateway = payments.get_gateway()
+
+    def pay(self, payment_id, signature=None):
+        signature = signature or payments.sign(self.test_bill.rzp_id, payment_id, 'secret')
+        return self.client.post(reverse('handle-payment'), data={
+            'razorpay_payment_id': payment_id,
+            'razorpay_order_id': self.test_bill.rzp_id,
+            'razorpay_signature': signature,
+        })
+
+    def open_payment(self):
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        response = self.client.post(reverse('open-payment'), data={'lang': '/en-us/', 'order_id': self.test_bill.id})
+        self.test_bill.refresh_from_db()
+        return response
+
+    def test_gateway_is_reused(self):
+        self.assertIs(payments.get_gateway(), self.gateway)
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_open_payment_and_capture(self):
+        response = self.open_payment()
+        self.assertEqual(response.json()['rp_order_id'], self.test_bill.rzp_id)
+        self.assertIn(self.test_bill.rzp_id, self.gateway.orders)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.pay('pay_1')
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertTemplateUsed(response, 'cart/payment_success.html')
+        # Captured by the worker, not by the callback
+        self.assertNotIn('pay_1', self.gateway.captured)
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).status.name, 'processing')
+        # A repeated callback does not queue the capture twice
+        self.pay('pay_1')
+        self.assertEqual(CaptureJob.objects.filter(bill=self.test_bill).count(), 1)
+
+        call_command('process_captures', once=True, stdout=StringIO())
+        bill = Bill.objects.get(id=self.test_bill.id)
+        self.assertEqual(bill.status.name, 'purchased')
+        self.assertEqual(bill.rzp_payment_id, 'pay_1')
+        self.assertEqual(self.gateway.captured['pay_1'], 100.0)
+        self.assertEqual(CaptureJob.objects.get(bill=self.test_bill).state, CaptureJob.DONE)
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_invalid_signature(self):
+        self.open_payment()
+        response = self.pay('pay_2', signature='forged')
+        self.assertTemplateUsed(response, 'cart/payment_failed.html')
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).status.name, 'payment failed')
+        self.assertFalse(CaptureJob.objects.filter(bill=self.test_bill).exists())
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_declined_capture_is_retried_then_failed(self):
+        self.open_payment()
+        self.gateway.declined.add('pay_3')
+        self.pay('pay_3')
+        self.assertEqual(CaptureJob.objects.process_batch(max_attempts=2), 1)
+        job = CaptureJob.objects.get(bill=self.test_bill)
+        self.assertEqual((job.state, job.attempts), (CaptureJob.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        # Not due yet
+        self.assertEqual(CaptureJob.objects.process_batch(max_attempts=2), 0)
+
+        CaptureJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(CaptureJob.objects.process_batch(max_attempts=2), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (CaptureJob.FAILED, 2))
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).status.name, 'payment failed')
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_failed_payments_give_back_the_coupon(self):
+        coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now(), max_uses=5)
+        Coupon.objects.filter(id=coupon.id).update(use_count=2)
+        self.test_bill.coupon = coupon
+        self.test_bill.save()
+        self.open_payment()
+        # Declined by the gateway
+        self.gateway.declined.add('pay_10')
+        self.pay('pay_10')
+        CaptureJob.objects.process_batch(max_attempts=1)
+        self.assertEqual(Coupon.objects.get(id=coupon.id).use_count, 1)
+        # A forged callback for an order whose payment already failed gives nothing back
+        self.pay('pay_10', signature='forged')
+        self.assertEqual(Coupon.objects.get(id=coupon.id).use_count, 1)
+
+        # A forged callback for a processing order
+        Bill.objects.filter(id=self.test_bill.id).update(status=self.test_status)
+        self.pay('pay_11', signature='forged')
+        self.assertEqual(Coupon.objects.get(id=coupon.id).use_count, 0)
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_capture_after_a_crash(self):
+        self.open_payment()
+        self.pay('pay_5')
+        # Captured by a worker that died before saving the job
+        self.gateway.capture('pay_5', 100.0)
+        self.assertEqual(CaptureJob.objects.process_batch(), 1)
+        self.assertEqual(CaptureJob.objects.get(bill=self.test_bill).state, CaptureJob.DONE)
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).status.name, 'purchased')
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_cancelled_bill_is_not_captured(self):
+        self.open_payment()
+        self.pay('pay_6')
+        # Cancelled while the job was waiting
+        Bill.objects.filter(id=self.test_bill.id).update(status=Status.objects.get_or_create(name='cancelled')[0])
+        self.assertEqual(CaptureJob.objects.process_batch(), 1)
+        self.assertNotIn('pay_6', self.gateway.captured)
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).status.name, 'cancelled')
+        job = CaptureJob.objects.get(bill=self.test_bill)
+        self.assertEqual((job.state, job.attempts), (CaptureJob.FAILED, 0))
+
+    @override_settings(RAZORPAY_KEY_SECRET='secret')
+    def test_cancel_order_drops_the_capture(self):
+        self.open_payment()
+        self.pay('pay_7')
+        self.client.post(reverse('cancel-order'), data={'uuid': self.test_bill.id})
+        self.assertFalse(CaptureJob.objects.filter(bill=self.test_bill).exists())
+        self.assertEqual(CaptureJob.objects.process_batch(), 0)
+
+        # A callback after the cancellation queues nothing
+        response = self.pay('pay_7')
+        self.assertTemplateUsed(response, 'cart/payment_failed.html')
+        self.assertFalse(CaptureJob.objects.filter(bill=self.test_bill).exists())
+        self.assertEqual(Bill.objects.get(id=self.test_bill.id).status.name, 'cancelled')
+        self.assertNotIn('pay_7', self.gateway.captured)
+
+    @override_settings(PAYMENT_POOL_SIZE=10)
+    def test_payments_captured_concurrently(self):
+        gateway = payments.FakeGateway()
+        gateway.latency = 0.2
+        gateway.declined.add('pay_9')
+        started = time.monotonic()
+        errors = async_to_sync(payments.capture_all)(gateway, [(f'pay_{i}', 10.0) for i in range(10)])
+        # One round trip, not ten
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(errors[:9], [None] * 9)
+        self.assertIsInstance(errors[9], payments.PaymentError)
+        self.assertEqual(len(gateway.captured), 9)
+
+    def test_blocking_gateway_captures_in_a_thread(self):
+        class BlockingGateway(payments.PaymentGateway):
+            def capture(self, payment_id, amount):
+                self.thread = threading.get_ident()
+        gateway = BlockingGateway()
+        async_to_sync(gateway.acapture)('pay_8', 10.0)
+        self.assertNotEqual(gateway.thread, threading.get_ident())
+
+    def test_gateway_session_has_timeout(self):
+        session = payments.create_session((1, 2), retries=2, pool_size=4)
+        adapter = session.get_adapter('https://api.razorpay.com')
+        self.assertEqual(session.timeout, (1, 2))
+        self.assertEqual(adapter.max_retries.connect, 2)
+        self.assertEqual(adapter.max_retries.read, 0)
+
 class CancelOrderViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='test', email='test@gmail.com')
@@ -310,6 +1022,77 @@ class CancelOrderViewTest(TestCase):
         response = self.client.post(reverse('cancel-order'), data={'uuid': self.test_bill.id})
         self.assertEqual(response.status_code, 200)
 
+@override_settings(PAYMENT_GATEWAY='main.utils.payments.FakeGateway')
+class ReceiptViewTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+        self.test_food = Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        self.test_coupon = Coupon.objects.create(code='HALF', value=0.5, start=timezone.now())
+        processing, notExist = Status.objects.get_or_create(name='processing')
+        self.test_bill = Bill.objects.create(
+            user=self.test_user, recipient='Recipient', phone_number='123456789', address='123 Main Street',
+            total=50.0, status=processing, coupon=self.test_coupon,
+        )
+        Item.objects.create(bill=self.test_bill, food=self.test_food, quantity=2, unit_price=50.0)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+
+    def test_snapshot_written_when_purchased(self):
+        CaptureJob.objects.enqueue(self.test_bill, 'pay_receipt', 'signature')
+        CaptureJob.objects.process_batch()
+        receipt = Bill.objects.get(id=self.test_bill.id).receipt
+        self.assertEqual(receipt['items'], [{'food_id': self.test_food.id, 'name': 'Pizza', 'quantity': 2, 'unit_price': 50.0}])
+        self.assertEqual(receipt['subtotal'], 100.0)
+        self.assertEqual(receipt['coupon'], {'code': 'HALF', 'value': 0.5})
+        self.assertEqual(receipt['total'], 50.0)
+
+        # Renaming or repricing the food does not change the receipt, read with the bill only
+        self.test_food.name = 'Margherita'
+        self.test_food.save()
+        Item.objects.filter(bill=self.test_bill).update(unit_price=80.0)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('receipt', args=[self.test_bill.id]))
+        self.assertContains(response, 'Pizza')
+        self.assertContains(response, '$50.0')
+        self.assertNotContains(response, 'Margherita')
+
+        page = json.loads(self.client.get(reverse('profile-orders')).content)
+        self.assertIn('Pizza', page['html'])
+
+    def test_order_count_of_purchased_bills(self):
+        CaptureJob.objects.enqueue(self.test_bill, 'pay_count', 'signature')
+        CaptureJob.objects.process_batch()
+        self.assertEqual(Food.objects.get(id=self.test_food.id).order_count, 2)
+        # Counted once: the purchased bill is neither captured nor counted again
+        CaptureJob.objects.filter(bill=self.test_bill).update(state=CaptureJob.PENDING)
+        CaptureJob.objects.process_batch()
+        self.assertEqual(CaptureJob.objects.get(bill=self.test_bill).state, CaptureJob.FAILED)
+        self.assertEqual(Food.objects.get(id=self.test_food.id).order_count, 2)
+
+        self.client.post(reverse('cancel-order'), data={'uuid': self.test_bill.id})
+        self.assertEqual(Food.objects.get(id=self.test_food.id).order_count, 0)
+
+    def test_snapshot_written_once_when_cancelled(self):
+        self.client.post(reverse('cancel-order'), data={'uuid': self.test_bill.id})
+        bill = Bill.objects.get(id=self.test_bill.id)
+        self.assertEqual(bill.receipt['items'][0]['name'], 'Pizza')
+        Item.objects.filter(bill=bill).delete()
+        bill.save()
+        self.assertEqual(Bill.objects.get(id=bill.id).receipt['items'][0]['name'], 'Pizza')
+
+    def test_open_order_read_from_items(self):
+        self.test_food.name = 'Margherita'
+        self.test_food.save()
+        response = self.client.get(reverse('receipt', args=[self.test_bill.id]))
+        self.assertContains(response, 'Margherita')
+        self.assertIsNone(Bill.objects.get(id=self.test_bill.id).receipt)
+
+    def test_receipt_of_another_user(self):
+        other = User.objects.create(username='other', email='other@gmail.com')
+        Bill.objects.filter(id=self.test_bill.id).update(user=other)
+        self.assertEqual(self.client.get(reverse('receipt', args=[self.test_bill.id])).status_code, 404)
+
 class WishListViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='test', email='test@gmail.com')
@@ -358,3 +1141,47 @@ class RemoveFromWishListViewTest(TestCase):
         login = self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
         response = self.client.delete(reverse('remove-from-wishlist', kwargs={'id': self.test_food.pk}))
         self.assertEqual(response.status_code, 200)
+
+@override_settings(REQUEST_TIMING_SAMPLE_RATE=1.0, METRICS_TOKEN='scrape')
+class TimingMiddlewareTest(TestCase):
+    def setUp(self):
+        timing.metrics.reset()
+        Food.objects.create(name='Pizza', description='Test food description', price=50.0)
+        self.test_user = User.objects.create(username='test', email='test@gmail.com')
+        self.test_user.set_password('1X<ISRUkw+tuK')
+        self.test_user.save()
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        header = response['Server-Timing']
+        self.assertIn('db;dur=', header)
+        self.assertIn(f'desc="{len(queries)} queries"', header)
+        self.assertIn('tpl;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    def test_metrics_aggregated_by_route(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE restaurant_request_duration_seconds histogram', body)
+        self.assertIn('restaurant_request_duration_seconds_count{route="index",method="GET"} 2', body)
+        self.assertIn('restaurant_request_queries_bucket{route="index",method="GET",le="+Inf"} 2', body)
+        self.assertIn('restaurant_request_template_seconds_sum{route="index",method="GET"}', body)
+
+    def test_metrics_forbidden_without_staff_or_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.client.login(email=self.test_user.email, password='1X<ISRUkw+tuK')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.test_user.is_staff = True
+        self.test_user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_disabled_when_not_sampled(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertNotIn('route="index"', timing.metrics.render())
@@ -12,15 +12,22 @@ urlpatterns = [
     path('password-reset-confirm/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(template_name='accounts/password_reset_confirm.html'), name='password_reset_confirm'),
     path('password-reset-complete/', auth_views.PasswordResetCompleteView.as_view(template_name='accounts/password_reset_complete.html'), name='password_reset_complete'),
     path('search/', views.index, name='search'),
+    path('menu/', views.menu_page, name='menu-page'),
     path('food/<int:id>/details/', views.food_details, name='food-details'),
+    path('food/<int:id>/reviews/', views.review_page, name='review-page'),
     path('food/<int:id>/details/review/', views.review, name='review'),
     path('food/<int:food_id>/details/review/<int:review_id>/reply/', views.reply, name='reply'),
     path('delete-review/<int:id>', views.delete_review, name="delete-review"),
     path('delete-reply/<int:id>', views.delete_reply, name="delete-reply"),
     path('cart/', views.cart, name="cart"),
+    path('cart/totals/', views.cart_totals, name="cart-totals"),
     path('add-to-cart/', views.add_to_cart, name="add-to-cart"),
+    path('apply-coupon/', views.apply_coupon, name="apply-coupon"),
     path('remove-from-cart/<id>', views.remove_from_cart, name="remove-from-cart"),
     path('profile/', views.profile, name='profile'),
+    path('profile/orders/', views.profile_orders, name='profile-orders'),
+    path('profile/reviews/', views.profile_reviews, name='profile-reviews'),
+    path('profile/comments/', views.profile_comments, name='profile-comments'),
     path('checkout/', views.checkout, name="checkout"),
     path('handle-checkout/', views.handle_checkout, name="handle-checkout"),
     path('payment/<uuid:id>', views.handle_checkout, name="payment"),
@@ -0,0 +1,61 @@
+'''
+The cart of the current user, loaded at most once per request.
+'''
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils.functional import cached_property
+
+class Cart:
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def bill(self):
+        '''The bill with the `cart` status, one query. None until the first food is added.'''
+        from main.models import Bill
+        if not self.user.is_authenticated:
+            return None
+        return Bill.objects.select_related('coupon').filter(cart_owner=self.user).first()
+
+    def get_or_create_bill(self):
+        from main.models import Bill
+        if self.bill is None:
+            self.bill = Bill.objects.get_or_create_cart(self.user)
+        return self.bill
+
+    @cached_property
+    def items(self):
+        '''Items with their food and the food images, two queries whatever the size of the cart.'''
+        if self.bill is None:
+            return []
+        return list(self.bill.item_set.select_related('food').prefetch_related('food__image_set').order_by('id'))
+
+    def set_quantities(self, quantities):
+        '''
+        Sets the quantities of the items, a dict food id -> quantity, in one UPDATE.
+        Returns False, changing nothing, if a food is not in the cart.
+        '''
+        from main.models import Item
+        if self.bill is None:
+            return False
+        if not quantities:
+            return True
+        quantity = Case(*[When(food_id=food_id, then=Value(value)) for food_id, value in quantities.items()])
+        with transaction.atomic():
+            updated = Item.objects.filter(bill=self.bill, food_id__in=quantities.keys()).update(quantity=quantity)
+            if updated != len(quantities):
+                transaction.set_rollback(True)
+                return False
+        # The items loaded before have the old quantities
+        self.__dict__.pop('items', None)
+        return True
+
+    @property
+    def food_ids(self):
+        return {item.food_id for item in self.items}
+
+def get_cart(request):
+    '''The Cart of the request, created on first use.'''
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request.user)
+    return request._cart
@@ -1,4 +1,5 @@
 PHONE_NUMBER_VALIDATOR=r'^\+?1?\d{9,15}$'
+MAX_ITEM_QUANTITY = 100
 RATE_TEMPLATE = {
     5: ['success', 0, 0], 
     4: ['primary', 0, 0], 
@@ -6,3 +7,10 @@ RATE_TEMPLATE = {
     2: ['warning', 0, 0], 
     1: ['danger', 0, 0]
 }
+
+class StatusName:
+    CART = 'cart'
+    PROCESSING = 'processing'
+    PURCHASED = 'purchased'
+    PAYMENT_FAILED = 'payment failed'
+    CANCELLED = 'cancelled'
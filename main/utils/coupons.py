@@ -0,0 +1,37 @@
+'''
+In-process registry of the coupons valid now, keyed by code, so an unknown or expired code does not query the Coupon table.
+
+It is loaded with the coupons that are valid now or later, and expires at the next start or end
+of one of them. The Coupon signals invalidate it. The usage counters are not cached: they are read
+with `Coupon.objects.available` when a coupon is applied, and `Coupon.objects.redeem` checks and
+counts a use in a single UPDATE when the order is placed.
+'''
+from django.utils import timezone
+from .registry import Registry
+
+class CouponUnavailable(Exception):
+    '''The coupon of an order expired or has no uses left.'''
+
+class CouponRegistry(Registry):
+    def get(self, code):
+        '''The Coupon called `code` if it is active and valid now, else None.'''
+        return self.get_value().get(code)
+
+    def load(self):
+        from main.models import Coupon
+        now = timezone.now()
+        by_code = {}
+        boundaries = []
+        for coupon in Coupon.objects.filter(is_active=True).exclude(end__lte=now):
+            if coupon.start > now:
+                boundaries.append(coupon.start)
+            else:
+                by_code[coupon.code] = coupon
+            if coupon.end is not None:
+                boundaries.append(coupon.end)
+        return by_code, min(boundaries, default=None)
+
+registry = CouponRegistry()
+
+def get_coupon(code):
+    return registry.get(code.strip())
@@ -0,0 +1,70 @@
+'''
+Versioned fragment cache of the HTML of each food: the menu cards and the header of the details page.
+
+Every food has a version in the cache, part of the keys of its fragments. The signals of
+Food, Image and Review replace it: the old fragments are not read anymore and expire.
+The fragments hold nothing specific to a user. They are split at the USER_SLOT markers,
+and the page renders the cart and wishlist toggles between the parts.
+'''
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.safestring import mark_safe
+import time
+
+USER_SLOT = '<!--user-slot-->'
+
+# Only fetched for the foods whose fragments are rendered
+PREFETCH = ('image_set',)
+
+def get_cache():
+    return caches[settings.FRAGMENT_CACHE]
+
+def version_key(food_id):
+    return f'food:{food_id}:version'
+
+def _new_version():
+    return time.time_ns()
+
+def replace_version(cache, key):
+    '''Replaces a version now, and again on commit: a request may have cached the old rows meanwhile.'''
+    def replace():
+        cache.set(key, _new_version(), None)
+    replace()
+    transaction.on_commit(replace)
+
+def get_versions(cache, keys):
+    '''The versions stored at `keys`, created if missing: a dict key -> version.'''
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # `add`, not `set`: another process may have just created or replaced it
+            version = _new_version()
+            versions[key] = version if cache.add(key, version, None) else cache.get(key, version)
+    return versions
+
+def invalidate(food_id):
+    replace_version(get_cache(), version_key(food_id))
+
+def get_fragments(template_name, foods):
+    '''
+    The fragment of `template_name` of each food, rendered with `food` in its context:
+    a list of (food, parts) pairs, the parts being the fragment split at USER_SLOT.
+    '''
+    cache = get_cache()
+    foods = list(foods)
+    language = translation.get_language()
+    versions = get_versions(cache, [version_key(food.id) for food in foods])
+    keys = {food.id: f'food:{food.id}:{versions[version_key(food.id)]}:{template_name}:{language}' for food in foods}
+    fragments = cache.get_many(keys.values())
+
+    missing = [food for food in foods if keys[food.id] not in fragments]
+    if missing:
+        prefetch_related_objects(missing, *PREFETCH)
+        rendered = {keys[food.id]: render_to_string(template_name, {'food': food}) for food in missing}
+        cache.set_many(rendered, settings.FRAGMENT_CACHE_TIMEOUT)
+        fragments.update(rendered)
+    return [(food, [mark_safe(part) for part in fragments[keys[food.id]].split(USER_SLOT)]) for food in foods]
@@ -0,0 +1,95 @@
+'''
+Full-page cache of the menu and food details pages for anonymous visitors.
+
+The pages are identical for every anonymous visitor of a language, except for the CSRF token
+of their forms: it is blanked in the cache and filled in for each visitor. Pages are keyed by
+path (with its language prefix) and query string, and by the versions of the menu or of the
+food, replaced by the model signals. Authenticated users and sessions holding messages
+bypass the cache. Each page has an ETag, so browsers revalidate with If-None-Match and get a 304.
+'''
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.middleware.csrf import get_token
+from django.utils import translation
+from django.utils.cache import patch_cache_control, patch_vary_headers
+import functools
+import hashlib
+import re
+from . import fragments
+
+MENU = 'menu'
+CSRF_FIELD = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+def get_cache():
+    return caches[settings.PAGE_CACHE]
+
+def version_key(scope):
+    return f'page:{scope}:version'
+
+def food_scope(food_id):
+    return f'food:{food_id}'
+
+def invalidate(food_id=None, menu=True):
+    '''Drops the menu pages and, given a food, its details page.'''
+    cache = get_cache()
+    if menu:
+        fragments.replace_version(cache, version_key(MENU))
+    if food_id is not None:
+        fragments.replace_version(cache, version_key(food_scope(food_id)))
+
+def _is_cacheable(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # The messages would be shown to every visitor
+    return not get_messages(request)
+
+def _etag(content):
+    return f'W/"{hashlib.md5(content).hexdigest()}"'
+
+def _page_key(request, scopes):
+    versions = fragments.get_versions(get_cache(), [version_key(scope) for scope in scopes])
+    page = ':'.join([translation.get_language(), request.get_full_path()] + [str(versions[key]) for key in sorted(versions)])
+    return 'page:' + hashlib.md5(page.encode()).hexdigest()
+
+def _respond(request, page, response=None):
+    content, content_type, etag = page
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    elif response is None:
+        # The token of this visitor, who gets the CSRF cookie if they have none yet
+        token = get_token(request).encode()
+        response = HttpResponse(CSRF_FIELD.sub(rb'\g<1>' + token + rb'\g<2>', content), content_type=content_type)
+    response['ETag'] = etag
+    # Revalidated on every visit: the same URL is not cached once logged in
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+def cache_anonymous_page(scopes):
+    '''
+    Caches the pages of the view for anonymous visitors.
+    `scopes(*args, **kwargs)` lists the versioned scopes of a page, called with the view arguments.
+    '''
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = _page_key(request, scopes(*args, **kwargs))
+            page = cache.get(key)
+            if page is not None:
+                return _respond(request, page)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming or response.cookies:
+                return response
+            content = CSRF_FIELD.sub(rb'\g<1>\g<2>', response.content)
+            page = (content, response['Content-Type'], _etag(content))
+            cache.set(key, page, settings.PAGE_CACHE_TIMEOUT)
+            return _respond(request, page, response)
+        return wrapper
+    return decorator
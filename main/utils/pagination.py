@@ -0,0 +1,101 @@
+'''
+Keyset (cursor) pagination: a page is fetched with "WHERE key > last key ORDER BY key LIMIT n",
+so its cost does not depend on how deep it is.
+'''
+from django.core.exceptions import SuspiciousOperation, ValidationError
+from django.db.models import Q
+import base64
+import binascii
+import datetime
+import json
+import uuid
+
+def _json_value(value):
+    # Full precision: DjangoJSONEncoder would cut the microseconds of a datetime
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} cannot be part of a cursor.')
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=_json_value).encode()).decode()
+
+def decode_cursor(cursor):
+    '''
+    The list of values of a cursor, numbers or strings.
+    Raises SuspiciousOperation, a 400 response, for anything else: the cursor comes from the query string.
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise SuspiciousOperation('Invalid page cursor.')
+    if not isinstance(values, list):
+        raise SuspiciousOperation('Invalid page cursor.')
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise SuspiciousOperation('Invalid page cursor.')
+    return values
+
+def _to_python(queryset, ordering, values):
+    # The values as the fields of the ordering expect them: "abc" is not an id
+    converted = []
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        if name in queryset.query.annotations:
+            model_field = queryset.query.annotations[name].output_field
+        else:
+            model_field = queryset.model._meta.get_field(name)
+        try:
+            converted.append(model_field.to_python(value))
+        except (ValidationError, ValueError, TypeError):
+            raise SuspiciousOperation('Invalid page cursor.')
+    return converted
+
+def _after(ordering, values):
+    # (a, b) after (x, y) means: a after x, or a == x and b after y
+    condition, equal = Q(), {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+def keyset_page(queryset, ordering, cursor, size):
+    '''
+    Returns the `size` objects of `queryset` following `cursor` and the cursor of the next page (or None).
+    `ordering` must end with a unique field, e.g. ('-avg_rating', 'id').
+    '''
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise SuspiciousOperation('Invalid page cursor.')
+        queryset = queryset.filter(_after(ordering, _to_python(queryset, ordering, values)))
+
+    # One extra row tells if there is a next page
+    objects = list(queryset[:size + 1])
+    next_cursor = None
+    if len(objects) > size:
+        last = objects[size - 1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+    return objects[:size], next_cursor
+
+def ranked_page(queryset, ranked_ids, cursor, size):
+    '''
+    Same as `keyset_page` for an already ranked list of ids (search results):
+    the key is the rank, only the ids of the page are fetched.
+    '''
+    start = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+            raise SuspiciousOperation('Invalid page cursor.')
+        start = values[0]
+
+    page_ids = ranked_ids[start:start + size]
+    position = {object_id: i for i, object_id in enumerate(page_ids)}
+    objects = sorted(queryset.filter(id__in=page_ids), key=lambda obj: position[obj.id])
+    next_cursor = encode_cursor([start + size]) if start + size < len(ranked_ids) else None
+    return objects, next_cursor
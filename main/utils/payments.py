@@ -0,0 +1,160 @@
+'''
+Payment gateways behind `open_payment` and `handle_payment`.
+
+The gateway is picked with the PAYMENT_GATEWAY setting and created once per process,
+so its HTTP connections are reused between requests. Every call has a timeout.
+`acapture` is the coroutine version of `capture`: `capture_all` captures the payments
+of a batch of the `process_captures` worker concurrently.
+'''
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
+import functools
+import hashlib
+import hmac
+import requests
+import threading
+import time
+import uuid
+
+class PaymentError(Exception):
+    '''The gateway refused the call or could not be reached.'''
+
+class AlreadyCaptured(PaymentError):
+    '''The payment was captured by an earlier call.'''
+
+class PaymentGateway:
+    def create_order(self, amount, currency, receipt, notes):
+        '''Creates a payment order on the gateway and returns its id.'''
+        raise NotImplementedError
+
+    def capture(self, payment_id, amount):
+        '''Captures an authorized payment.'''
+        raise NotImplementedError
+
+    async def acapture(self, payment_id, amount):
+        # The blocking call runs in a worker thread, the event loop is not blocked
+        await sync_to_async(self.capture, thread_sensitive=False)(payment_id, amount)
+
+    def verify_signature(self, order_id, payment_id, signature):
+        '''True if the signature sent back by the checkout form is genuine.'''
+        return hmac.compare_digest(sign(order_id, payment_id, settings.RAZORPAY_KEY_SECRET), signature)
+
+def sign(order_id, payment_id, secret):
+    '''The signature of a payment, as computed by Razorpay.'''
+    message = f'{order_id}|{payment_id}'.encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+class TimeoutSession(requests.Session):
+    '''requests.Session with a default timeout: requests has none.'''
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+def create_session(timeout, retries, pool_size):
+    session = TimeoutSession(timeout)
+    # Only connection errors are retried: the request did not reach the gateway,
+    # so retrying a POST cannot create an order or capture a payment twice
+    retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class RazorpayGateway(PaymentGateway):
+    def __init__(self):
+        import razorpay
+        session = create_session(settings.PAYMENT_TIMEOUT, settings.PAYMENT_RETRIES, settings.PAYMENT_POOL_SIZE)
+        self.client = razorpay.Client(session=session, auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+
+    def _call(self, method, *args):
+        import razorpay
+        try:
+            return method(*args)
+        except razorpay.errors.BadRequestError as error:
+            # "This payment has already been captured"
+            if 'already been captured' in str(error):
+                raise AlreadyCaptured(str(error)) from error
+            raise PaymentError(str(error)) from error
+        except (razorpay.errors.GatewayError,
+                razorpay.errors.ServerError, requests.RequestException, ValueError) as error:
+            raise PaymentError(str(error)) from error
+
+    def create_order(self, amount, currency, receipt, notes):
+        data = dict(amount=amount, currency=currency, receipt=receipt, notes=notes, payment_capture=0)
+        return self._call(self.client.order.create, data)['id']
+
+    def capture(self, payment_id, amount):
+        self._call(self.client.payment.capture, payment_id, amount)
+
+class FakeGateway(PaymentGateway):
+    '''
+    Local gateway for the tests and the load benchmarks: nothing leaves the process.
+    Payments are captured unless their id is in `declined`.
+    PAYMENT_FAKE_LATENCY (seconds) simulates the round trip to the gateway.
+    '''
+    def __init__(self):
+        self.latency = getattr(settings, 'PAYMENT_FAKE_LATENCY', 0)
+        self.orders = {}
+        self.captured = {}
+        self.declined = set()
+        self._lock = threading.Lock()
+
+    def create_order(self, amount, currency, receipt, notes):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._create_order(amount, currency, receipt, notes)
+
+    def capture(self, payment_id, amount):
+        if self.latency:
+            time.sleep(self.latency)
+        self._capture(payment_id, amount)
+
+    async def acapture(self, payment_id, amount):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._capture(payment_id, amount)
+
+    def _create_order(self, amount, currency, receipt, notes):
+        order_id = f'order_{uuid.uuid4().hex[:14]}'
+        with self._lock:
+            self.orders[order_id] = dict(amount=amount, currency=currency, receipt=receipt, notes=notes)
+        return order_id
+
+    def _capture(self, payment_id, amount):
+        with self._lock:
+            if payment_id in self.captured:
+                raise AlreadyCaptured(f'Payment {payment_id} has already been captured.')
+            if payment_id in self.declined:
+                raise PaymentError(f'Payment {payment_id} cannot be captured.')
+            self.captured[payment_id] = amount
+
+async def capture_all(gateway, payments):
+    '''
+    Captures the (payment_id, amount) pairs concurrently, PAYMENT_POOL_SIZE at a time.
+    Returns the PaymentError of each payment, or None if it was captured, in the same order.
+    '''
+    semaphore = asyncio.Semaphore(settings.PAYMENT_POOL_SIZE)
+
+    async def capture(payment_id, amount):
+        async with semaphore:
+            try:
+                await gateway.acapture(payment_id, amount)
+            except PaymentError as error:
+                return error
+
+    return await asyncio.gather(*(capture(payment_id, amount) for payment_id, amount in payments))
+
+@functools.lru_cache(maxsize=None)
+def _load_gateway(path):
+    return import_string(path)()
+
+def get_gateway():
+    return _load_gateway(settings.PAYMENT_GATEWAY)
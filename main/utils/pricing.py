@@ -0,0 +1,37 @@
+'''
+Totals of a cart or an order, computed by the database in one aggregate query: the items are not loaded.
+
+Amounts are Decimals rounded to the cent. The coupon value multiplies the subtotal,
+and the delivery charges are added after the discount.
+'''
+from django.db.models import F, FloatField, Sum
+from decimal import Decimal
+import collections
+
+CENT = Decimal('0.01')
+
+Totals = collections.namedtuple('Totals', 'quantity subtotal discount delivery_charges total')
+
+def _decimal(value):
+    # str: the shortest representation of a float, not its binary expansion
+    return Decimal(str(value or 0))
+
+def get_totals(bill):
+    '''The Totals of the bill, from its items and its coupon (select_related when there is one).'''
+    from main.models import Item
+    aggregate = Item.objects.filter(bill=bill).aggregate(
+        quantity=Sum('quantity'),
+        subtotal=Sum(F('unit_price') * F('quantity'), output_field=FloatField()),
+    )
+    subtotal = _decimal(aggregate['subtotal']).quantize(CENT)
+    discount = Decimal(0).quantize(CENT)
+    if bill.coupon_id:
+        discount = (subtotal * (1 - _decimal(bill.coupon.value))).quantize(CENT)
+    delivery_charges = _decimal(bill.delivery_charges).quantize(CENT)
+    return Totals(
+        quantity=aggregate['quantity'] or 0,
+        subtotal=subtotal,
+        discount=discount,
+        delivery_charges=delivery_charges,
+        total=subtotal - discount + delivery_charges,
+    )
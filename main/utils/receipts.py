@@ -0,0 +1,39 @@
+'''
+Receipt snapshots: what a bill contained when it was purchased or cancelled.
+
+A snapshot is a plain dict stored in `Bill.receipt`, written once. Renaming or repricing
+a food later does not change the receipts, and a receipt is read with its bill only.
+'''
+from django.utils import timezone
+from .constant import StatusName
+
+VERSION = 1
+# The statuses after which a bill does not change anymore
+RECEIPT_STATUSES = (StatusName.PURCHASED, StatusName.CANCELLED)
+
+def snapshot(bill):
+    '''
+    The receipt of the bill from its items (with their food) and its coupon.
+    Uses their prefetched or select_related values when there are some.
+    '''
+    items = [
+        {
+            'food_id': item.food_id,
+            'name': item.food.name if item.food else '',
+            'quantity': item.quantity,
+            'unit_price': item.unit_price,
+        }
+        for item in bill.item_set.all()
+    ]
+    coupon = None
+    if bill.coupon_id:
+        coupon = {'code': bill.coupon.code, 'value': bill.coupon.value}
+    return {
+        'version': VERSION,
+        'created': timezone.now().isoformat(),
+        'items': items,
+        'subtotal': round(sum(item['quantity'] * item['unit_price'] for item in items), 2),
+        'coupon': coupon,
+        'delivery_charges': float(bill.delivery_charges),
+        'total': bill.total,
+    }
@@ -0,0 +1,34 @@
+'''
+Base of the in-process registries of `statuses` and `coupons`: rows read once and kept
+in memory until the signals of their model invalidate them, or until they expire.
+'''
+from django.db import connection
+from django.utils import timezone
+import threading
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = None
+
+    def load(self):
+        '''Reads the rows: returns the value to keep and when it expires (None: never).'''
+        raise NotImplementedError
+
+    def get_value(self):
+        '''The value kept, loaded again if there is none or it expired.'''
+        value, expires = self._value, self._expires
+        if value is None or (expires is not None and timezone.now() >= expires):
+            value, expires = self.load()
+            # Only cache committed rows: what is read inside a transaction may be rolled back
+            if not connection.in_atomic_block:
+                with self._lock:
+                    self._value = value
+                    self._expires = expires
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._expires = None
@@ -0,0 +1,303 @@
+'''
+Search backends behind the menu search (`search/` route).
+
+The backend is picked with the SEARCH_BACKEND setting. Every backend returns
+the ids of the matching foods, most relevant first.
+'''
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.utils.module_loading import import_string
+import bisect
+import collections
+import functools
+import math
+import re
+import threading
+import time
+import unicodedata
+
+TOKEN_PATTERN = re.compile(r'\w+')
+FTS_TABLE = 'main_food_fts'
+# Matches in the name count more than matches in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_TOKEN_LENGTH = 64
+# Minimum trigram similarity for a typo-tolerant match, e.g. "piza" ~ "pizza"
+FUZZY_THRESHOLD = 0.3
+# How many prefixed and similar tokens one query term expands to, at most
+MAX_EXPANSIONS = 20
+# 'đ' is a letter of its own in Unicode, NFKD does not decompose it
+FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'D'})
+
+def fold(text):
+    '''Lowercase `text` and strip its diacritics: "Phở Bò" -> "pho bo".'''
+    text = unicodedata.normalize('NFKD', (text or '').translate(FOLD_TABLE))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(fold(text))
+
+def trigrams(token):
+    '''Trigrams of a token, padded like pg_trgm: "pho" -> {"  p", " ph", "pho", "ho "}.'''
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def token_weights(name, description):
+    '''Folded tokens of a food with their weight.'''
+    weights = collections.defaultdict(float)
+    for token in tokenize(name):
+        weights[token[:MAX_TOKEN_LENGTH]] += NAME_WEIGHT
+    for token in tokenize(description):
+        weights[token[:MAX_TOKEN_LENGTH]] += DESCRIPTION_WEIGHT
+    return weights
+
+class SearchBackend:
+    def search(self, query, limit=None):
+        '''Return the ids of the foods matching `query`, most relevant first.'''
+        raise NotImplementedError
+
+    def index_food(self, food):
+        '''Called after a food is saved.'''
+
+    def remove_food(self, food_id):
+        '''Called when a food is deleted, before its related rows are.'''
+
+    def rebuild(self):
+        '''Rebuild the whole index from the Food table.'''
+
+class DatabaseSearchBackend(SearchBackend):
+    '''
+    Full-text search in the database: a FULLTEXT index on MySQL, an FTS5 table on SQLite.
+    Other databases fall back to `icontains` lookups.
+    '''
+    def __init__(self):
+        self._mysql_fulltext = None
+
+    def search(self, query, limit=None):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        limit = limit or settings.SEARCH_MAX_RESULTS
+
+        if connection.vendor == 'mysql':
+            return self._search_mysql(terms, limit)
+        if connection.vendor == 'sqlite':
+            return self._search_sqlite(terms, limit)
+        return self._search_fallback(terms, limit)
+
+    def _search_mysql(self, terms, limit):
+        from main.models import Food
+        # InnoDB does not index the words shorter than innodb_ft_min_token_size nor its stopwords:
+        # "gà", "bò" or "mì" are looked up with LIKE instead
+        min_token_size, stopwords = self._mysql_fulltext_settings()
+        indexed = [term for term in terms if len(term) >= min_token_size and term not in stopwords]
+        conditions, params = [], []
+        for term in terms:
+            if term not in indexed:
+                pattern = '%' + term.replace('_', '\\_') + '%'
+                conditions.append('name LIKE %s OR description LIKE %s')
+                params.extend([pattern, pattern])
+        order, order_params = 'id', []
+        if indexed:
+            # Boolean mode: any of the terms, each one as a prefix ("sus*" finds "sushi")
+            against = ' '.join(f'{term}*' for term in indexed)
+            match = 'MATCH(name, description) AGAINST (%s IN BOOLEAN MODE)'
+            conditions.append(match)
+            params.append(against)
+            # The foods only found with LIKE come last
+            order, order_params = f'{match} DESC, id', [against]
+        where = ' OR '.join(f'({condition})' for condition in conditions)
+        sql = f'SELECT id FROM {Food._meta.db_table} WHERE {where} ORDER BY {order} LIMIT %s'
+        return self._fetch_ids(sql, params + order_params + [limit])
+
+    def _mysql_fulltext_settings(self):
+        '''The minimum token size and the stopwords of the InnoDB FULLTEXT indexes, read once.'''
+        if self._mysql_fulltext is None:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT @@innodb_ft_min_token_size, @@innodb_ft_enable_stopword, @@innodb_ft_server_stopword_table')
+                min_token_size, enable_stopword, stopword_table = cursor.fetchone()
+                stopwords = set()
+                if enable_stopword:
+                    if stopword_table:
+                        # "database/table"
+                        table = '.'.join(connection.ops.quote_name(name) for name in stopword_table.split('/'))
+                        cursor.execute(f'SELECT value FROM {table}')
+                    else:
+                        cursor.execute('SELECT value FROM INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD')
+                    stopwords = {fold(row[0]) for row in cursor.fetchall()}
+            self._mysql_fulltext = (min_token_size, stopwords)
+        return self._mysql_fulltext
+
+    def _search_sqlite(self, terms, limit):
+        match = ' OR '.join(f'"{term}"*' for term in terms)
+        sql = (
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}), rowid LIMIT %s'
+        )
+        return self._fetch_ids(sql, [match, limit])
+
+    def _search_fallback(self, terms, limit):
+        from main.models import Food
+        lookups = [Q(name__icontains=term) | Q(description__icontains=term) for term in terms]
+        foods = Food.objects.filter(functools.reduce(lambda x, y: x | y, lookups))
+        return list(foods.order_by('id').values_list('id', flat=True)[:limit])
+
+    def _fetch_ids(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_food(self, food):
+        # MySQL maintains its FULLTEXT index by itself
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [food.id])
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                    [food.id, fold(food.name), fold(food.description)],
+                )
+
+    def remove_food(self, food_id):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [food_id])
+
+    def rebuild(self):
+        from main.models import Food
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            for food in Food.objects.only('id', 'name', 'description').iterator():
+                self.index_food(food)
+
+class InvertedIndexBackend(SearchBackend):
+    '''
+    In-process inverted index over Food.name and Food.description, ranked by tf-idf.
+    The index is built lazily, dropped when a food changes in this process and
+    rebuilt after SEARCH_INDEX_TTL seconds to pick up changes from other processes.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def search(self, query, limit=None):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        limit = limit or settings.SEARCH_MAX_RESULTS
+        index = self._get_index()
+
+        scores = collections.defaultdict(float)
+        for term in terms:
+            for token in index.tokens_with_prefix(term):
+                postings = index.postings[token]
+                idf = math.log(1 + index.food_count / len(postings))
+                for food_id, weight in postings.items():
+                    scores[food_id] += weight * idf
+
+        return sorted(scores, key=lambda food_id: (-scores[food_id], food_id))[:limit]
+
+    def _get_index(self):
+        index = self._index
+        if index is None or time.monotonic() - index.built_at > settings.SEARCH_INDEX_TTL:
+            with self._lock:
+                if self._index is index:
+                    self._index = _InvertedIndex.build()
+                index = self._index
+        return index
+
+    def index_food(self, food):
+        self._index = None
+
+    def remove_food(self, food_id):
+        self._index = None
+
+    def rebuild(self):
+        self._index = _InvertedIndex.build()
+
+class TokenIndexBackend(SearchBackend):
+    '''
+    Accent-insensitive, typo-tolerant search over the SearchToken table.
+    Each query term matches the tokens it prefixes and, through the SearchTrigram
+    table, the tokens with a trigram similarity of at least FUZZY_THRESHOLD.
+    Both are indexed lookups, the Food table is never scanned.
+    The tables are only maintained while this is the SEARCH_BACKEND: after switching to it, rebuild them.
+    '''
+    def index_food(self, food):
+        from main.models import SearchToken
+        SearchToken.objects.index_food(food)
+
+    def remove_food(self, food_id):
+        from main.models import SearchToken
+        SearchToken.objects.remove_food(food_id)
+
+    def rebuild(self):
+        from main.models import SearchToken
+        SearchToken.objects.rebuild()
+
+    def search(self, query, limit=None):
+        from main.models import SearchToken, SearchTrigram
+        terms = tokenize(query)
+        if not terms:
+            return []
+        limit = limit or settings.SEARCH_MAX_RESULTS
+
+        # How similar is each candidate token to the query terms?
+        similarity = {}
+        for term in set(terms):
+            similarity[term] = 1.0
+            if len(term) < 3:
+                continue
+            # A range instead of `startswith`: SQLite's LIKE cannot use the index
+            successor = term[:-1] + chr(ord(term[-1]) + 1)
+            prefixed = SearchToken.objects.filter(token__gte=term, token__lt=successor).values_list('token', flat=True).distinct()
+            for token in prefixed[:MAX_EXPANSIONS]:
+                similarity[token] = 1.0
+            similar = sorted(SearchTrigram.objects.similar_tokens(term, FUZZY_THRESHOLD), key=lambda pair: -pair[1])
+            for token, score in similar[:MAX_EXPANSIONS]:
+                similarity[token] = max(similarity.get(token, 0), score)
+
+        # Rank in the database so only the best `limit` foods come back
+        token_similarity = Case(*[When(token=token, then=Value(score)) for token, score in similarity.items()], output_field=FloatField())
+        ranked = (
+            SearchToken.objects.filter(token__in=similarity)
+            .values('food_id')
+            .annotate(score=Sum(F('weight') * token_similarity))
+            .order_by('-score', 'food_id')
+        )
+        return [row['food_id'] for row in ranked[:limit]]
+
+class _InvertedIndex:
+    def __init__(self, postings, food_count):
+        self.postings = postings
+        self.tokens = sorted(postings)
+        self.food_count = food_count
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        from main.models import Food
+        postings = collections.defaultdict(lambda: collections.defaultdict(float))
+        food_count = 0
+        for food_id, name, description in Food.objects.values_list('id', 'name', 'description').iterator():
+            food_count += 1
+            for token in tokenize(name):
+                postings[token][food_id] += NAME_WEIGHT
+            for token in tokenize(description):
+                postings[token][food_id] += DESCRIPTION_WEIGHT
+        return cls(postings, food_count)
+
+    def tokens_with_prefix(self, prefix):
+        # Tokens are sorted, so every token starting with `prefix` is in one run
+        i = bisect.bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            yield self.tokens[i]
+            i += 1
+
+@functools.lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+def get_backend():
+    return _load_backend(settings.SEARCH_BACKEND)
@@ -0,0 +1,24 @@
+'''
+In-process registry of the order statuses, so views do not query the Status table on every request.
+Use the names of `constant.StatusName`: get_status(StatusName.CART).
+'''
+from .registry import Registry
+
+class StatusRegistry(Registry):
+    def get(self, name):
+        '''The Status called `name`, created if it does not exist yet.'''
+        from main.models import Status
+        status = self.get_value().get(name)
+        if status is None:
+            # The post_save signal invalidates the registry
+            status, created = Status.objects.get_or_create(name=name)
+        return status
+
+    def load(self):
+        from main.models import Status
+        return {status.name: status for status in Status.objects.all()}, None
+
+registry = StatusRegistry()
+
+def get_status(name):
+    return registry.get(name)
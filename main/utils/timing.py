@@ -0,0 +1,147 @@
+'''
+Per-request timings collected by `main.middleware.TimingMiddleware`:
+query count, SQL time, template render time and total time.
+
+The timings of the request being served live in a context variable, so threads and
+asyncio tasks do not mix them. They are aggregated per route in in-memory histograms,
+exposed in the Prometheus text format by the `metrics` view.
+'''
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+import contextvars
+import math
+import threading
+import time
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+class RequestTimings:
+    __slots__ = ('queries', 'sql', 'template', '_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        self._depth = 0
+
+    def execute(self, execute, sql, params, many, context):
+        '''A `connection.execute_wrapper`: counts and times every query.'''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total):
+        '''The value of the Server-Timing header, durations in milliseconds.'''
+        return (
+            f'db;dur={self.sql * 1000:.1f};desc="{self.queries} queries", '
+            f'tpl;dur={self.template * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+
+def start():
+    '''Starts collecting the timings of the current request; returns them and the token to `stop`.'''
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+def stop(token):
+    _current.reset(token)
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        # Only the outermost render is timed: render_to_string may be called while rendering
+        timings._depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings._depth -= 1
+            if not timings._depth:
+                timings.template += time.perf_counter() - start
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    '''
+    The Django template backend, timing the renders of the requests sampled by TimingMiddleware.
+    Template time includes the queries run while rendering (lazy querysets, context processors).
+    '''
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+class Histogram:
+    '''Cumulative Prometheus histogram, one series per label set.'''
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            # One count per bucket, then +Inf, sum
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+            bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {_number(series[-1])}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series[-2]}')
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    if isinstance(value, float) and math.isfinite(value):
+        return repr(round(value, 6))
+    return str(value)
+
+class Metrics:
+    '''The timings of the sampled requests of this process, by route and method.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.duration = Histogram('restaurant_request_duration_seconds', 'Total time of the request.', SECONDS_BUCKETS)
+            self.sql = Histogram('restaurant_request_sql_seconds', 'Time spent running SQL queries.', SECONDS_BUCKETS)
+            self.template = Histogram('restaurant_request_template_seconds', 'Time spent rendering templates.', SECONDS_BUCKETS)
+            self.queries = Histogram('restaurant_request_queries', 'SQL queries run by the request.', QUERIES_BUCKETS)
+
+    def observe(self, route, method, timings, total):
+        labels = (('route', route), ('method', method))
+        with self._lock:
+            self.duration.observe(labels, total)
+            self.sql.observe(labels, timings.sql)
+            self.template.observe(labels, timings.template)
+            self.queries.observe(labels, timings.queries)
+
+    def render(self):
+        with self._lock:
+            histograms = (self.duration, self.sql, self.template, self.queries)
+            return '\n'.join(line for histogram in histograms for line in histogram.render()) + '\n'
+
+metrics = Metrics()
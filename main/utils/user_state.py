@@ -0,0 +1,38 @@
+'''
+What the current user has in the cart and in the wishlist, loaded once per request.
+'''
+from django.utils.functional import cached_property
+
+class UserState:
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def cart_food_ids(self):
+        from main.models import Item
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(
+            Item.objects.filter(bill__cart_owner=self.user).values_list('food_id', flat=True)
+        )
+
+    @cached_property
+    def wishlist_food_ids(self):
+        from main.models import User
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(
+            User.food_saved.through.objects.filter(user_id=self.user.id).values_list('food_id', flat=True)
+        )
+
+    def in_cart(self, food):
+        return food.id in self.cart_food_ids
+
+    def in_wishlist(self, food):
+        return food.id in self.wishlist_food_ids
+
+def get_user_state(request):
+    '''The UserState of the request, created on first use.'''
+    if not hasattr(request, '_user_state'):
+        request._user_state = UserState(request.user)
+    return request._user_state
@@ -1,75 +1,109 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.http import urlencode
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import Avg, Q, Func
 from django.forms import modelform_factory
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, prefetch_related_objects
 from django.core import serializers
 from django.conf import settings
 from django.forms.models import model_to_dict
 from django.utils import timezone
-import functools
 import copy
 import json
 import re
-import razorpay
-from decimal import Decimal
-from .models import Food, Review, Reply, Bill, Item, Status, User
+import uuid
+from .models import Food, Review, Reply, Bill, Item, User, Coupon, CaptureJob
 from .forms import UserRegisterForm
-from .utils.constant import RATE_TEMPLATE, PHONE_NUMBER_VALIDATOR
-
-def get_cart(request):
-    bill, cart_items, in_cart = None, None, []
-    if request.user.is_authenticated:
-        status = get_object_or_404(Status, name='cart')
-        bill = Bill.objects.prefetch_related('item_set').filter(user=request.user, status=status).first()
-        cart_items = bill.item_set.all()
-        in_cart = [item.food for item in cart_items]
-    
-    return bill, cart_items, in_cart
-    
-def count_rating(reviews):
+from .utils.constant import RATE_TEMPLATE, PHONE_NUMBER_VALIDATOR, MAX_ITEM_QUANTITY, StatusName
+from .utils import coupons, pagination, payments, pricing, receipts, search, timing
+from .utils.page_cache import MENU, cache_anonymous_page, food_scope
+from .utils.cart import get_cart
+from .utils.statuses import get_status
+
+def count_rating(food):
     # Copy constant to another dict to reset dict value on page refresh
     _rate = copy.deepcopy(RATE_TEMPLATE)
     
-    # How many reviews per star?
-    for review in reviews:
-        i = review.rating
-        if i in _rate:
-            _rate[i][1] += 1
-            _rate[i][2] = int(_rate[i][1]/len(reviews) * 100)
+    # How many reviews per star? Read from the counters stored on the food
+    for i in _rate:
+        count = getattr(food, Food.star_field(i))
+        _rate[i][1] = count
+        if food.rating_count:
+            _rate[i][2] = int(count / food.rating_count * 100)
     
     return _rate
 
-def index(request):
-    foods = Food.objects.prefetch_related('image_set').annotate(avg_rating=Avg('review__rating')).order_by('-avg_rating')
-    query = ''
-    wishlist = None
-    if request.user.is_authenticated:
-        wishlist = request.user.food_saved.all()
+# Orderings of the menu, `id` breaks the ties for the keyset pagination
+MENU_ORDERINGS = {
+    'rating': ('-avg_rating', 'id'),
+    'best-sellers': ('-order_count', 'id'),
+}
+
+def get_menu_page(request):
+    '''One page of the menu, or of the search results, after the `cursor` of the request'''
+    query = request.GET.get('query', '').strip()
+    cursor = request.GET.get('cursor')
+    sort = request.GET.get('sort')
+    if sort not in MENU_ORDERINGS:
+        sort = 'rating'
+    # The images are only fetched for the cards missing from the fragment cache
+    foods = Food.objects.all()
+    result_count = None
+    result_capped = False
+
+    if query:
+        # Search each keyword of the query in names and descriptions, most relevant first. For example: "sushi pizza"
+        # One more than the maximum tells if the results were cut
+        food_ids = search.get_backend().search(query, limit=settings.SEARCH_MAX_RESULTS + 1)
+        result_capped = len(food_ids) > settings.SEARCH_MAX_RESULTS
+        food_ids = food_ids[:settings.SEARCH_MAX_RESULTS]
+        page, next_cursor = pagination.ranked_page(foods, food_ids, cursor, settings.MENU_PAGE_SIZE)
+        result_count = len(food_ids)
+    else:
+        page, next_cursor = pagination.keyset_page(foods, MENU_ORDERINGS[sort], cursor, settings.MENU_PAGE_SIZE)
 
-    if request.method == 'GET' and 'query' in request.GET:
-        query = request.GET['query'].strip()
-        keywords = query.split()
-        # Search for each keyword in query. For example: "sushi pizza"
-        foods = foods.filter(functools.reduce(lambda x, y: x | y, [Q(name__icontains=word) for word in keywords]))
+    # Query string of the next page, if any
+    next_page = ''
+    if next_cursor:
+        next_page = urlencode({'query': query, 'cursor': next_cursor} if query else {'sort': sort, 'cursor': next_cursor})
+    return page, query, sort, result_count, result_capped, next_page
 
-    bill, _, in_cart = get_cart(request)
+@cache_anonymous_page(lambda: [MENU])
+def index(request):
+    foods, query, sort, result_count, result_capped, next_page = get_menu_page(request)
 
     context = {
         "foods": foods,
         "keyword": query,
-        "in_cart": in_cart,
-        "wishlist": wishlist,
+        "sort": sort,
+        "result_count": result_count,
+        "result_capped": result_capped,
+        "next_page": next_page,
     }
     return render(request, 'index.html', context)
 
+def menu_page(request):
+    '''Next page of the menu for infinite scroll'''
+    foods, _, _, _, _, next_page = get_menu_page(request)
+
+    context = {
+        "foods": foods,
+    }
+    return JsonResponse({
+        "html": render_to_string('foods/cards.html', context, request=request),
+        "count": len(foods),
+        "next_url": f"{reverse('menu-page')}?{next_page}" if next_page else None,
+    })
+
 @csrf_protect
 def register(request):
     if request.method == 'POST':
@@ -85,27 +119,60 @@ def register(request):
         form = UserRegisterForm()
     return render(request, 'accounts/register.html', {'form': form})
 
-class Round(Func):
-    function = 'ROUND'
-    template='%(function)s(%(expressions)s, 2)'
-
+# Orderings of the reviews of a food, ending with a unique field for the keyset pagination.
+# "helpful": the reviews with the most replies first
+REVIEW_ORDERINGS = {
+    'newest': ('-date_created', '-id'),
+    'helpful': ('-reply_count', '-date_created', '-id'),
+}
+
+def get_review_page(request, food):
+    '''One page of the reviews of the food, with their author and their replies with their author: three queries'''
+    sort = request.GET.get('sort')
+    if sort not in REVIEW_ORDERINGS:
+        sort = 'newest'
+    replies = Reply.objects.select_related('user').order_by('date_created', 'id')
+    reviews = Review.objects.filter(food=food).select_related('user').prefetch_related(Prefetch('reply_set', queryset=replies))
+    if sort == 'helpful':
+        reviews = reviews.annotate(reply_count=Count('reply'))
+    page, next_cursor = pagination.keyset_page(reviews, REVIEW_ORDERINGS[sort], request.GET.get('cursor'), settings.REVIEW_PAGE_SIZE)
+
+    next_url = None
+    if next_cursor:
+        next_url = f"{reverse('review-page', args=[food.id])}?{urlencode({'sort': sort, 'cursor': next_cursor})}"
+    return page, sort, next_url
+
+@cache_anonymous_page(lambda id: [food_scope(id)])
 def food_details(request, id):
-    food = Food.objects.prefetch_related('review_set').annotate(avg_rating=Round(Avg('review__rating'))).filter(id=id).first()
-    _, _, in_cart = get_cart(request)
-    reviews = food.review_set.all()
-    _rate = count_rating(reviews)
-    wishlist = None
-    if request.user.is_authenticated:
-        wishlist = request.user.food_saved.all()
+    # The images are only fetched if the header is missing from the fragment cache
+    food = get_object_or_404(Food, id=id)
+    reviews, sort, next_url = get_review_page(request, food)
+    _rate = count_rating(food)
 
     context = {
         "food": food,
         "rate_dict": _rate,
-        "in_cart": in_cart,
-        "wishlist": wishlist,
+        "reviews": reviews,
+        "review_sort": sort,
+        "next_reviews_url": next_url,
     }
     return render(request, 'foods/details.html', context)
 
+def review_page(request, id):
+    '''Next page of the reviews of a food'''
+    food = get_object_or_404(Food, id=id)
+    reviews, _, next_url = get_review_page(request, food)
+
+    context = {
+        "food": food,
+        "reviews": reviews,
+    }
+    return JsonResponse({
+        "html": render_to_string('foods/reviews.html', context, request=request),
+        "count": len(reviews),
+        "next_url": next_url,
+    })
+
 @login_required
 def review(request, id):
     if request.method == 'POST':
@@ -154,13 +221,12 @@ def delete_review(request, id):
     if review.delete():
         success = True
 
-    food = Food.objects.prefetch_related('review_set').annotate(avg_rating=Round(Avg('review__rating'))).filter(id=food_id).first()
-    reviews = food.review_set.all()
-    _rate = count_rating(reviews)
+    food = Food.objects.filter(id=food_id).first()
+    _rate = count_rating(food)
 
     context = {
         "success": success,
-        "new_average": food.avg_rating,
+        "new_average": round(food.avg_rating, 2),
         "rate_dict": _rate,
     }
 
@@ -179,29 +245,36 @@ def delete_reply(request, id):
 
 @login_required
 def cart(request):
-    bill, cart_items, _ = get_cart(request)
+    current_cart = get_cart(request)
     
     context = {
-        "cart": bill,
-        "items": cart_items
+        "cart": current_cart.bill,
+        "items": current_cart.items,
+        "totals": pricing.get_totals(current_cart.bill) if current_cart.items else None,
     }
     return render(request, 'cart/cart.html', context)
 
 @login_required
 def add_to_cart(request):
-    bill, cart_items, _ = get_cart(request)
+    bill = get_cart(request).get_or_create_bill()
     food = get_object_or_404(Food, id=request.POST.get('id'))
     action = ''
 
-    if cart_items.filter(food=food).exists():
-        get_object_or_404(Item, food=food, bill=bill).delete()
+    # Remove the food if it is already in the cart, add it otherwise
+    removed, _ = Item.objects.filter(bill=bill, food=food).delete()
+    if removed:
         action = 'remove'
     else:
         if food.discount:
             unit_price = float(food.price) * float(food.discount)
         else:
             unit_price = food.price
-        Item.objects.create(food=food, bill=bill, quantity=1, unit_price=unit_price)
+        try:
+            with transaction.atomic():
+                Item.objects.create(food=food, bill=bill, quantity=1, unit_price=unit_price)
+        except IntegrityError:
+            # Added by a concurrent request (double click)
+            pass
         action = 'add'
 
     context = {
@@ -210,6 +283,31 @@ def add_to_cart(request):
 
     return JsonResponse(context)
 
+@login_required
+def apply_coupon(request):
+    '''Applies the coupon `code` to the cart, or removes the coupon of the cart if the code is empty.'''
+    if request.method != "POST":
+        return HttpResponseBadRequest()
+    bill = get_cart(request).bill
+    if bill is None:
+        raise Http404
+    code = request.POST.get('code', '')
+    coupon = None
+    if code.strip():
+        # From the in-process registry: no query for an unknown or expired code.
+        # The uses left are not cached, they are checked like when the order is placed
+        coupon = coupons.get_coupon(code)
+        if coupon is None or not Coupon.objects.available().filter(id=coupon.id).exists():
+            return JsonResponse({"success": False, "message": _("This coupon is not valid.")})
+    Bill.objects.filter(id=bill.id).update(coupon=coupon)
+
+    context = {
+        "success": True,
+        "code": coupon.code if coupon else '',
+        "value": coupon.value if coupon else None,
+    }
+    return JsonResponse(context)
+
 @login_required
 def remove_from_cart(request, id):
     success = False
@@ -251,41 +349,95 @@ def profile(request):
         return redirect('profile')
 
     else:
-        reviews = Review.objects.filter(user=request.user)
-        replies = Reply.objects.filter(user=request.user)
-        status = get_object_or_404(Status, name='cart')
-        orders = Bill.objects.filter(user=request.user).exclude(status=status)
-        
+        # Only the counts: the sections are loaded page by page by `profile_orders`, `profile_reviews`, `profile_comments`
         context = {
-            "reviews": reviews,
-            "comments": replies,
-            "orders": orders
+            "review_count": Review.objects.filter(user=request.user).count(),
+            "comment_count": Reply.objects.filter(user=request.user).count(),
+            "order_count": get_orders(request.user).count(),
         }
     
     return render(request, 'accounts/profile.html', context)
 
+def get_orders(user):
+    return Bill.objects.filter(user=user).exclude(status=get_status(StatusName.CART))
+
+def profile_section(request, queryset, ordering, template_name, url_name, prepare=None):
+    '''
+    One page of a section of the profile page, after the `cursor` of the request.
+    `prepare` is called with the objects of the page, e.g. to prefetch their relations.
+    '''
+    page, next_cursor = pagination.keyset_page(queryset, ordering, request.GET.get('cursor'), settings.PROFILE_PAGE_SIZE)
+    if prepare:
+        prepare(page)
+    return JsonResponse({
+        "html": render_to_string(template_name, {"objects": page}, request=request),
+        "count": len(page),
+        "next_url": f"{reverse(url_name)}?{urlencode({'cursor': next_cursor})}" if next_cursor else None,
+    })
+
+@login_required
+def profile_orders(request):
+    '''
+    Order history: the orders with their status and receipt snapshot,
+    then the items with their food of the orders not purchased or cancelled yet, if any
+    '''
+    def prefetch_items(orders):
+        items = Item.objects.select_related('food')
+        prefetch_related_objects([order for order in orders if order.receipt is None], Prefetch('item_set', queryset=items))
+
+    orders = get_orders(request.user).select_related('status')
+    return profile_section(request, orders, ('-order_date', '-id'), 'accounts/profile_orders.html', 'profile-orders', prefetch_items)
+
+@login_required
+def profile_reviews(request):
+    reviews = Review.objects.filter(user=request.user).select_related('food')
+    return profile_section(request, reviews, ('-date_created', '-id'), 'accounts/profile_reviews.html', 'profile-reviews')
+
+@login_required
+def profile_comments(request):
+    replies = Reply.objects.filter(user=request.user).select_related('parent__food')
+    return profile_section(request, replies, ('-date_created', '-id'), 'accounts/profile_comments.html', 'profile-comments')
+
+def get_quantities(request):
+    '''The quantities posted in `checkoutip`, a dict food id -> quantity, or None if they are invalid.'''
+    try:
+        cart = json.loads(request.POST.get('checkoutip'))
+        quantities = {int(food_id): int(quantity) for food_id, quantity in cart.items()}
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if any(not 1 <= quantity <= MAX_ITEM_QUANTITY for quantity in quantities.values()):
+        return None
+    return quantities
+
+@login_required
+def cart_totals(request):
+    '''The totals of the cart. A POST with `checkoutip` sets the quantities of its items first.'''
+    current_cart = get_cart(request)
+    if current_cart.bill is None:
+        raise Http404
+    if request.method == "POST":
+        quantities = get_quantities(request)
+        if quantities is None:
+            return HttpResponseBadRequest()
+        if not current_cart.set_quantities(quantities):
+            raise Http404
+    return JsonResponse(pricing.get_totals(current_cart.bill)._asdict())
+
 @login_required
 def checkout(request):
-    cart = request.POST.get('checkoutip')
-    cart = json.loads(cart)
-    bill, _, _ = get_cart(request)
-    final_price = 0
-    
-    with transaction.atomic():
-        for keys, values in cart.items():
-            food = get_object_or_404(Food, id=int(keys))
-            item = get_object_or_404(Item, food=food, bill=bill)
-            item.quantity = int(values)
-            item.save()
-            final_price = final_price + item.unit_price * int(values)
-    
-    if bill.coupon:
-        final_price = Decimal(final_price * bill.coupon.value) + bill.delivery_charges
-    else:
-        final_price = Decimal(final_price) + bill.delivery_charges
-        
+    quantities = get_quantities(request)
+    if quantities is None:
+        return HttpResponseBadRequest()
+
+    current_cart = get_cart(request)
+    if current_cart.bill is None:
+        return redirect('cart')
+    if not current_cart.set_quantities(quantities):
+        raise Http404
+
     context = {
-        "fprice": final_price
+        "totals": pricing.get_totals(current_cart.bill),
+        "order_token": uuid.uuid4(),
     }
 
     return render(request, 'cart/checkout.html', context)
@@ -293,7 +445,6 @@ def checkout(request):
 @login_required
 def handle_checkout(request, id=0):
     if request.method == "POST":
-        final_price = request.POST.get('fprice')
         inputName = request.POST.get('inputName')
         inputPhoneNo = request.POST.get('inputPhoneNo')
         inputAddress = request.POST.get('inputAddress')
@@ -302,27 +453,36 @@ def handle_checkout(request, id=0):
         inputZip = request.POST.get('inputZip')
         inputShipNote = request.POST.get('inputShipNote')
 
-        for v in [inputName, inputPhoneNo, inputAddress, inputCity, inputCountry, inputZip, final_price]:
+        for v in [inputName, inputPhoneNo, inputAddress, inputCity, inputCountry, inputZip]:
             if len(v.split()) == 0:
                 return redirect('cart')
         
-        current_bill, _, _ = get_cart(request)
-        status = get_object_or_404(Status, name='processing')
-        
-        with transaction.atomic():
-            new_bill, notExist = Bill.objects.get_or_create(
-                user = request.user,
+        # Without a token from the form, the order cannot be deduplicated
+        order_token = request.POST.get('orderToken')
+        try:
+            order_token = uuid.UUID(order_token) if order_token else uuid.uuid4()
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        cart = get_cart(request).bill
+        try:
+            new_bill = Bill.objects.place_order(
+                cart,
+                order_token,
                 recipient = inputName,
                 phone_number = inputPhoneNo,
                 address = inputAddress,
                 city = inputCity,
                 country = inputCountry,
                 zip_code = inputZip,
-                total = final_price,
                 shipping_note = inputShipNote,
-                status = status,
             )
-            Item.objects.filter(bill=current_bill).update(bill=new_bill)
+        except coupons.CouponUnavailable:
+            Bill.objects.filter(id=cart.id).update(coupon=None)
+            messages.error(request, _("Your coupon has expired or has no uses left, it was removed from your cart."))
+            return redirect('cart')
+        if new_bill is None or new_bill.user_id != request.user.id:
+            return redirect('cart')
 
         context = {
             "order" : new_bill,
@@ -348,13 +508,15 @@ def cancel_order(request):
     success = False
     new_status = ''
     order_id = request.POST.get('uuid')
-    order = Bill.objects.prefetch_related('item_set').filter(user=request.user, id=order_id).first()
-    cancelled_status, notExist = Status.objects.get_or_create(name='cancelled')
-    if order and cancelled_status:
-        order.status = cancelled_status
-        order.save()
+    # The items with their food and the coupon, for the receipt and the order counts
+    items = Item.objects.select_related('food')
+    order = (
+        Bill.objects.select_related('coupon').prefetch_related(Prefetch('item_set', queryset=items))
+        .filter(user=request.user, id=order_id).first()
+    )
+    if order and Bill.objects.cancel(order):
         success = True
-        new_status = cancelled_status.name
+        new_status = order.status.name
         
     context = {
         "success": success,
@@ -381,14 +543,16 @@ def open_payment(request):
             'zip_code': current_order.zip_code,
             'shipping_note': current_order.shipping_note,
         }
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-        payment = client.order.create(dict(amount=order_total, currency=order_currency, receipt=order_receipt, notes=notes, payment_capture=0))
-        current_order.rzp_id = payment['id']
+        try:
+            rzp_id = payments.get_gateway().create_order(order_total, order_currency, order_receipt, notes)
+        except payments.PaymentError:
+            return JsonResponse({"error": _("The payment service is unavailable, please try again later.")}, status=503)
+        current_order.rzp_id = rzp_id
         current_order.save()
 
         context = {
             "order_id": order_id,
-            "rp_order_id": payment['id'],
+            "rp_order_id": rzp_id,
             "order": model_to_dict(current_order),
             "email": request.user.email,
             "amount": current_order.total,
@@ -404,50 +568,35 @@ def handle_payment(request):
         rzp_payment_id = request.POST.get('razorpay_payment_id', '')
         rzp_id = request.POST.get('razorpay_order_id', '')
         rzp_signature = request.POST.get('razorpay_signature', '')
-        params_dict = {
-            'razorpay_order_id': rzp_id,
-            'razorpay_payment_id': rzp_payment_id,
-            'razorpay_signature': rzp_signature,
-        }
         order_db = get_object_or_404(Bill, rzp_id=rzp_id)
-        order_db.rzp_payment_id = rzp_payment_id
-        order_db.rzp_signature = rzp_signature
-        order_db.save()
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-        result = client.utility.verify_payment_signature(params_dict)
-
-        if result == None:
-            amount = order_db.total
-            try:
-                client.payment.capture(rzp_payment_id, amount)
-                purchased = get_object_or_404(Status, name='purchased')
-                order_db.order_date = timezone.now()
-                order_db.status = purchased
-                order_db.save()
-                extra = {
-                    'order_id': order_db.id,
-                }
-                return render(request, 'cart/payment_success.html', extra)
-            except:
-                payment_failed = get_object_or_404(Status, name='payment failed')
-                order_db.status = payment_failed
-                order_db.save()
+
+        if payments.get_gateway().verify_signature(rzp_id, rzp_payment_id, rzp_signature):
+            # The payment is captured by the `process_captures` worker, unless the order was cancelled
+            if CaptureJob.objects.enqueue(order_db, rzp_payment_id, rzp_signature) is None:
                 return render(request, 'cart/payment_failed.html')
+            extra = {
+                'order_id': order_db.id,
+            }
+            return render(request, 'cart/payment_success.html', extra)
         else:
-            payment_failed = get_object_or_404(Status, name='payment failed')
-            order_db.status = payment_failed
-            order_db.save()
+            # Only an order still waiting for its payment: a cancelled one stays cancelled
+            with transaction.atomic():
+                failed = Bill.objects.filter(id=order_db.id, status=get_status(StatusName.PROCESSING)).update(
+                    status=get_status(StatusName.PAYMENT_FAILED),
+                    rzp_payment_id=rzp_payment_id,
+                    rzp_signature=rzp_signature,
+                )
+                if failed and order_db.coupon_id:
+                    Coupon.objects.release(order_db.coupon_id)
             return render(request, 'cart/payment_failed.html')
 
 @login_required
 def wishlist(request):
     user = request.user
-    wishlist = user.food_saved.annotate(avg_rating=Avg('review__rating')).all()
-    _, _, in_cart = get_cart(request)
+    wishlist = user.food_saved.prefetch_related('image_set').all()
 
     context = {
         "wishlist": wishlist,
-        "in_cart": in_cart
     }
     return render(request, 'accounts/wishlist.html', context)
     
@@ -492,12 +641,27 @@ def remove_from_wishlist(request, id):
 
 @login_required
 def receipt(request, id):
-    bill = Bill.objects.prefetch_related('item_set').filter(user=request.user, id=id).first()
-    if bill.user == request.user:
-        context = {
-            'bill': bill,
-            'items': bill.item_set.all(),
-        }
-        return render(request, 'cart/receipt.html', context)
-    else:
-        return HttpResponse("403 Forbidden")
+    # The snapshot of a purchased or cancelled bill comes with it: one query.
+    # The other bills are read from their current items
+    bill = get_object_or_404(Bill, user=request.user, id=id)
+    receipt = bill.receipt
+    if receipt is None:
+        prefetch_related_objects([bill], Prefetch('item_set', queryset=Item.objects.select_related('food')), 'coupon')
+        receipt = receipts.snapshot(bill)
+
+    context = {
+        'bill': bill,
+        'receipt': receipt,
+    }
+    return render(request, 'cart/receipt.html', context)
+
+def metrics(request):
+    '''
+    Request timings aggregated by TimingMiddleware, in the Prometheus text format.
+    For staff users, or a scraper sending `Authorization: Bearer <METRICS_TOKEN>`.
+    '''
+    token = settings.METRICS_TOKEN
+    scraper = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not (scraper or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(timing.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -66,7 +67,7 @@ ROOT_URLCONF = 'restaurant.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.utils.timing.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -76,6 +77,8 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'main.context_processors.login_redirect',
+                'main.context_processors.user_state',
+                'main.context_processors.current_cart',
             ],
         },
     },
@@ -149,6 +152,48 @@ STATIC_URL = '/static/'
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 
+# Foods per page of the menu and of the search results
+MENU_PAGE_SIZE = 12
+# Reviews per page of the food details
+REVIEW_PAGE_SIZE = 10
+# Orders, reviews and comments per page of the profile sections
+PROFILE_PAGE_SIZE = 10
+
+# Menu search: `main.utils.search.DatabaseSearchBackend` (MySQL FULLTEXT / SQLite FTS5),
+# `main.utils.search.TokenIndexBackend` (accent-insensitive and typo-tolerant, but slower: 2 queries per search word)
+# or `main.utils.search.InvertedIndexBackend` (in-process index).
+# Only the configured backend follows the changes of the foods: run `manage.py rebuild_search_index` after switching
+SEARCH_BACKEND = 'main.utils.search.DatabaseSearchBackend'
+# Search results beyond this are not shown, the page says so
+SEARCH_MAX_RESULTS = 100
+SEARCH_INDEX_TTL = 300
+
+# `default` is Django's per-process cache. The fragments of `main.utils.fragments` (menu cards, food header)
+# can be shared by the processes: FRAGMENT_CACHE_URL=filecache:///var/tmp/restaurant-fragments
+# or dbcache://fragment_cache (after `manage.py createcachetable`)
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': env.cache('FRAGMENT_CACHE_URL', default='locmemcache://fragments'),
+    # Pages of `main.utils.page_cache` for anonymous visitors (menu, food details), same backends
+    'pages': env.cache('PAGE_CACHE_URL', default='locmemcache://pages'),
+}
+FRAGMENT_CACHE = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+PAGE_CACHE = 'pages'
+PAGE_CACHE_TIMEOUT = 10 * 60
+
 # Razorpay test mode
 RAZORPAY_KEY_ID = env('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = env('RAZORPAY_KEY_SECRET')
+
+# `main.utils.payments.RazorpayGateway` or `main.utils.payments.FakeGateway` (local, for tests and benchmarks)
+PAYMENT_GATEWAY = 'main.utils.payments.RazorpayGateway'
+# (connect, read) timeouts in seconds, retries of failed connections, kept-alive connections
+PAYMENT_TIMEOUT = (3.05, 10)
+PAYMENT_RETRIES = 2
+PAYMENT_POOL_SIZE = 10
+
+# Fraction of the requests timed by `main.middleware.TimingMiddleware` (Server-Timing header,
+# histograms served at /metrics/ to staff users or with the bearer METRICS_TOKEN); 0 disables it
+REQUEST_TIMING_SAMPLE_RATE = env.float('REQUEST_TIMING_SAMPLE_RATE', default=0.0)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')